@@ -0,0 +1,53 @@
+"""Encode/decode cost and wire size per book row for each payload encoding.
+
+Rows come from the SQLite copy of the catalog (database/books.db, built by
+db_setup.py), so no MySQL server is needed:
+
+    python bench_codec.py [--repeat 20]
+"""
+import os, sys, sqlite3, time, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import codec
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database", "books.db")
+
+def load_rows():
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute("SELECT * FROM books ORDER BY bookID").fetchall()
+    conn.close()
+    return rows
+
+def best_of(repeat, func, *args):
+    """Fastest of `repeat` runs, in seconds (least disturbed by other load)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = load_rows()
+    # A get_book, a list_books page, a typical search and a very broad one
+    sizes = [1, 20, 500, len(rows)]
+
+    print(f"{'encoding':<10} {'rows':>6} {'bytes/row':>10} {'encode us/row':>14} {'decode us/row':>14}")
+    for encoding in codec.available_encodings():
+        name = codec.ENCODING_NAMES[encoding]
+        for n in sizes:
+            message = {"result": rows[:n]}
+            payload = codec.encode(message, encoding)
+            enc = best_of(args.repeat, codec.encode, message, encoding)
+            dec = best_of(args.repeat, codec.decode, payload, encoding)
+            wire = len(payload) + codec.HEADER.size
+            print(f"{name:<10} {n:>6} {wire / n:>10.1f} {enc / n * 1e6:>14.2f} {dec / n * 1e6:>14.2f}")
+    if codec.msgpack is None:
+        print("(install msgpack to compare the binary encoding)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Concurrency sweep across the book servers, with a comparison report.
+
+Each server is started in turn on a free local port with the SQLite backend
+(BOOKDB_BACKEND=sqlite, serving database/books.db), loaded with loadgen.py at
+every concurrency level of the sweep, then stopped:
+
+    python bench_servers.py [--servers books,threaded,mp] [--concurrency 1,4,16,64]
+                            [--duration 10] [--rate 500] [--out results]
+
+Writes <out>/report.md (one throughput/latency table per server plus a
+side-by-side summary) and <out>/results.json (everything, with raw
+histograms). Server logs go to <out>/<server>.log.
+
+Requests use a new connection each by default, the way the servers were
+originally used; --keepalive reuses them instead. Note that the
+single-threaded server_books.py only ever serves one kept-alive client.
+"""
+import os, sys, socket, time, json, signal, argparse, subprocess
+
+import loadgen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXP4 = os.path.join(HERE, "..", "..", "exp4")
+
+# name -> (server script, extra server options)
+SERVERS = {
+    "books": (os.path.join(HERE, "..", "server", "server_books.py"), []),
+    "threaded": (os.path.join(EXP4, "server_threaded.py"), []),
+    "threaded-pool": (os.path.join(EXP4, "server_threaded.py"), ["--workers", "32"]),
+    "mp": (os.path.join(EXP4, "server_mp.py"), []),
+    "mp-prefork": (os.path.join(EXP4, "server_mp.py"), ["--prefork"]),
+    "async": (os.path.join(EXP4, "server_async.py"), []),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(name, port, log):
+    script, options = SERVERS[name]
+    cmd = [sys.executable, script, str(port)] + options
+    env = dict(os.environ, BOOKDB_BACKEND="sqlite")
+    # Own process group, so forked workers are stopped with the server
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env,
+                            cwd=os.path.dirname(script), start_new_session=True)
+    deadline = time.monotonic() + 60  # index warm-up included
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{name} exited with status {proc.returncode}; see {log.name}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError(f"{name} did not start listening on port {port}")
+
+def stop_server(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        pass
+
+def sweep(name, levels, args, out):
+    port = free_port()
+    with open(os.path.join(out, f"{name}.log"), "w") as log:
+        proc = start_server(name, port, log)
+        try:
+            results = []
+            for concurrency in levels:
+                result = loadgen.run("127.0.0.1", port, concurrency, args.duration, args.warmup, args.rate,
+                                     args.mix, args.keepalive, args.timeout)
+                loadgen.print_result(result)
+                results.append(result)
+            return results
+        finally:
+            stop_server(proc)
+
+def error_count(result):
+    return sum(result["errors"].values())
+
+def write_report(path, runs, args):
+    lines = ["# Book server comparison", ""]
+    mode = f"open loop at {args.rate} req/s" if args.rate else "closed loop"
+    lines.append(f"{mode}, {args.duration:g}s measured after {args.warmup:g}s warm-up, mix `{args.mix}`, "
+                 f"{'keep-alive' if args.keepalive else 'new connection per request'}, SQLite backend.")
+    lines.append("")
+    header = "| concurrency | req/s | p50 ms | p90 ms | p99 ms | p99.9 ms | max ms | errors |"
+    rule = "|---|---|---|---|---|---|---|---|"
+    for name, results in runs.items():
+        lines += [f"## {name}", "", header, rule]
+        for r in results:
+            s = r["latency"]
+            lines.append(f"| {r['config']['concurrency']} | {r['throughput_rps']} | {s['p50_ms']:.2f} | "
+                         f"{s['p90_ms']:.2f} | {s['p99_ms']:.2f} | {s['p99.9_ms']:.2f} | {s['max_ms']:.2f} | "
+                         f"{error_count(r)} |")
+        lines.append("")
+
+    # Side by side: throughput and p99 per server at each level
+    names = list(runs)
+    lines += ["## Summary (req/s / p99 ms)", "",
+              "| concurrency | " + " | ".join(names) + " |",
+              "|---|" + "---|" * len(names)]
+    levels = [r["config"]["concurrency"] for r in next(iter(runs.values()))]
+    for i, level in enumerate(levels):
+        cells = []
+        for name in names:
+            r = runs[name][i]
+            cell = f"{r['throughput_rps']} / {r['latency']['p99_ms']:.2f}"
+            cells.append(cell + (f" ({error_count(r)} err)" if error_count(r) else ""))
+        lines.append(f"| {level} | " + " | ".join(cells) + " |")
+    lines.append("")
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency sweep across the book servers")
+    parser.add_argument("--servers", default="books,threaded,mp", help=f"comma-separated, from {', '.join(SERVERS)}")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="comma-separated levels to sweep")
+    parser.add_argument("--rate", type=float, help="open loop at this rate (concurrency = max connections)")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--mix", default=loadgen.DEFAULT_MIX)
+    parser.add_argument("--keepalive", action="store_true", help="reuse connections between requests")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--out", default="bench_results")
+    args = parser.parse_args()
+
+    names = args.servers.split(",")
+    for name in names:
+        if name not in SERVERS:
+            parser.error(f"unknown server {name!r}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    os.makedirs(args.out, exist_ok=True)
+
+    runs = {}
+    for name in names:
+        print(f"=== {name}")
+        runs[name] = sweep(name, levels, args, args.out)
+
+    with open(os.path.join(args.out, "results.json"), "w") as f:
+        json.dump({"args": vars(args), "runs": runs}, f, indent=2)
+    write_report(os.path.join(args.out, "report.md"), runs, args)
+    print(f"Report written to {os.path.join(args.out, 'report.md')}")
+
+if __name__ == "__main__":
+    main()
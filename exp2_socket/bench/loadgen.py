@@ -0,0 +1,308 @@
+"""Load generator for the socket book servers.
+
+Closed loop: N clients, each sending its next request as soon as the
+previous one has been answered. Throughput is whatever the server sustains:
+
+    python loadgen.py --port 9000 --concurrency 16 --duration 20
+
+Open loop: requests start on a fixed schedule (--rate per second) whether or
+not earlier ones have finished, and --concurrency caps the connections used
+to send them. Latency is measured from each request's scheduled start, so a
+server that falls behind shows up in the percentiles instead of quietly
+slowing the generator down (coordinated omission):
+
+    python loadgen.py --port 9000 --rate 500 --duration 20
+
+--mix weighs the RPCs, e.g. get_book=70,search_books=20,list_books=10.
+Samples taken during --warmup are discarded. Latencies go into
+HdrHistogram-style histograms (server/histogram.py); --json writes the
+summary and the raw histograms.
+"""
+import os, sys, socket, time, json, random, argparse, threading, queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import codec
+from histogram import Histogram
+
+DEFAULT_MIX = "get_book=70,search_books=20,list_books=10"
+DEFAULT_KEYWORDS = ["the", "love", "war", "history", "harry", "life", "world", "king",
+                    "science", "night", "death", "american", "secret", "guide", "poems"]
+MAX_BOOK_ID = 45641  # highest bookID in books.csv
+
+
+def parse_mix(text):
+    """[(function, weight), ...] from 'get_book=70,search_books=30'."""
+    mix = []
+    for part in text.split(","):
+        function, _, weight = part.partition("=")
+        mix.append((function.strip(), float(weight or 1)))
+    if not mix or sum(w for _, w in mix) <= 0:
+        raise ValueError(f"Bad request mix {text!r}")
+    return mix
+
+
+class RequestMix:
+    """Draws (function, args) pairs according to the mix weights."""
+
+    def __init__(self, mix, book_ids=None, keywords=DEFAULT_KEYWORDS, seed=None):
+        self.functions = [f for f, _ in mix]
+        self.weights = [w for _, w in mix]
+        self.book_ids = book_ids
+        self.keywords = keywords
+        self.random = random.Random(seed)
+
+    def clone(self, seed):
+        """Same mix with its own random stream, for another client thread."""
+        return RequestMix(list(zip(self.functions, self.weights)), self.book_ids, self.keywords, seed)
+
+    def next(self):
+        function = self.random.choices(self.functions, self.weights)[0]
+        if function == "get_book":
+            if self.book_ids:
+                return function, [self.random.choice(self.book_ids)]
+            return function, [self.random.randint(1, MAX_BOOK_ID)]
+        if function == "get_books":
+            ids = self.book_ids or range(1, MAX_BOOK_ID + 1)
+            return function, [self.random.sample(ids, 20)]
+        if function == "search_books":
+            return function, [self.random.choice(self.keywords)]
+        return function, []
+
+
+class Connection:
+    """One client socket; with keepalive=False every call opens a new one,
+    as the Streamlit client originally did."""
+
+    def __init__(self, host, port, keepalive=True, timeout=10.0, encoding=codec.ENC_JSON):
+        self.server = (host, port)
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.encoding = encoding
+        self.sock = self.rfile = None
+
+    def _read_exact(self, n):
+        data = self.rfile.read(n)
+        if len(data) < n:
+            raise ConnectionError("Connection closed")
+        return data
+
+    def call(self, function, args):
+        if self.sock is None:
+            self.sock = socket.create_connection(self.server, timeout=self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.rfile = self.sock.makefile("rb")
+        try:
+            self.sock.sendall(codec.frame({"function": function, "args": args}, self.encoding))
+            size, flags = codec.unpack_header(self._read_exact(codec.HEADER.size))
+            message = codec.decode(self._read_exact(size), codec.encoding_of(flags))
+        except Exception:
+            self.close()
+            raise
+        if not self.keepalive or message.get("code") == "busy":
+            self.close()
+        return message
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.rfile.close()
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = self.rfile = None
+
+
+class Recorder:
+    """Per-worker latency histograms and error counts (merged at the end)."""
+
+    def __init__(self):
+        self.latency = {}   # function -> Histogram
+        self.errors = {}    # kind -> count
+
+    def ok(self, function, seconds):
+        hist = self.latency.get(function)
+        if hist is None:
+            hist = self.latency[function] = Histogram()
+        hist.record_seconds(seconds)
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def merge(self, other):
+        for function, hist in other.latency.items():
+            self.latency.setdefault(function, Histogram()).merge(hist)
+        for kind, n in other.errors.items():
+            self.errors[kind] = self.errors.get(kind, 0) + n
+
+
+def timed_call(conn, recorder, function, args, started):
+    """Make one call and record its latency measured from `started`."""
+    try:
+        message = conn.call(function, args)
+    except socket.timeout:
+        recorder.error("timeout")
+        return
+    except OSError:
+        recorder.error("connection")
+        return
+    except ValueError:
+        recorder.error("protocol")  # undecodable response
+        return
+    elapsed = time.perf_counter() - started
+    if message.get("code") == "busy":
+        recorder.error("busy")
+    elif "error" in message and function != "get_book":  # a missing book is a normal answer
+        recorder.error("rpc")
+    else:
+        recorder.ok(function, elapsed)
+
+def closed_loop(make_conn, mix, concurrency, measure_from, stop_at):
+    recorders = [Recorder() for _ in range(concurrency)]
+
+    def client(recorder, seed):
+        conn = make_conn()
+        requests = mix.clone(seed)
+        scratch = Recorder()
+        while True:
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            function, args = requests.next()
+            timed_call(conn, recorder if started >= measure_from else scratch, function, args, started)
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(r, i), daemon=True) for i, r in enumerate(recorders)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorders, 0
+
+def open_loop(make_conn, mix, concurrency, rate, measure_from, stop_at):
+    recorders = [Recorder() for _ in range(concurrency)]
+    schedule = queue.Queue()
+    requests = mix.clone(0)
+
+    def sender(recorder):
+        conn = make_conn()
+        scratch = Recorder()
+        while True:
+            item = schedule.get()
+            if item is None:
+                break
+            due, function, args = item
+            timed_call(conn, recorder if due >= measure_from else scratch, function, args, due)
+        conn.close()
+
+    threads = [threading.Thread(target=sender, args=(r,), daemon=True) for r in recorders]
+    for t in threads:
+        t.start()
+    start, sent = time.perf_counter(), 0
+    while True:
+        due = start + sent / rate
+        if due >= stop_at:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        schedule.put((due,) + requests.next())
+        sent += 1
+    # Requests still queued at the end never got a connection in time
+    backlog = schedule.qsize()
+    while True:
+        try:
+            schedule.get_nowait()
+        except queue.Empty:
+            break
+    for _ in threads:
+        schedule.put(None)
+    for t in threads:
+        t.join()
+    return recorders, backlog
+
+
+def fetch_book_ids(host, port, keyword="e"):
+    """Real bookIDs to draw get_book requests from (bookIDs have gaps)."""
+    conn = Connection(host, port, timeout=30.0)
+    try:
+        rows = conn.call("search_books", [keyword]).get("result") or []
+    except OSError:
+        rows = []
+    finally:
+        conn.close()
+    return [row[0] for row in rows]
+
+def run(host, port, concurrency=8, duration=10.0, warmup=2.0, rate=None, mix=DEFAULT_MIX,
+        keepalive=True, timeout=10.0, encoding=codec.ENC_JSON, keywords=DEFAULT_KEYWORDS):
+    """Run one load test and return its results as a dict."""
+    pairs = parse_mix(mix) if isinstance(mix, str) else mix
+    mix = RequestMix(pairs, fetch_book_ids(host, port), keywords)
+    make_conn = lambda: Connection(host, port, keepalive, timeout, encoding)
+    start = time.perf_counter()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+    if rate:
+        recorders, backlog = open_loop(make_conn, mix, concurrency, rate, measure_from, stop_at)
+    else:
+        recorders, backlog = closed_loop(make_conn, mix, concurrency, measure_from, stop_at)
+    elapsed = time.perf_counter() - measure_from
+
+    total = Recorder()
+    for r in recorders:
+        total.merge(r)
+    overall = Histogram()
+    for hist in total.latency.values():
+        overall.merge(hist)
+    return {
+        "config": {"host": host, "port": port, "mode": "open" if rate else "closed",
+                   "concurrency": concurrency, "rate": rate, "duration": duration, "warmup": warmup,
+                   "mix": dict(pairs), "keepalive": keepalive,
+                   "encoding": codec.ENCODING_NAMES[encoding]},
+        "elapsed_s": round(elapsed, 3),
+        "requests": overall.count,
+        "throughput_rps": round(overall.count / elapsed, 1) if elapsed > 0 else 0.0,
+        "errors": total.errors,
+        "backlog": backlog,  # open loop: requests still waiting for a connection at the end
+        "latency": overall.summary(),
+        "functions": {f: h.summary() for f, h in sorted(total.latency.items())},
+        "histograms": {f: h.to_dict() for f, h in sorted(total.latency.items())},
+    }
+
+def print_result(result):
+    cfg = result["config"]
+    load = f"rate {cfg['rate']}/s" if cfg["mode"] == "open" else f"{cfg['concurrency']} clients"
+    print(f"{cfg['host']}:{cfg['port']}  {cfg['mode']} loop, {load}, {result['elapsed_s']}s measured")
+    print(f"  {result['requests']} requests, {result['throughput_rps']} req/s, errors: {result['errors'] or 'none'}"
+          + (f", {result['backlog']} still queued at the end" if result["backlog"] else ""))
+    print(f"  {'function':<14} {'count':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9} {'max ms':>9}")
+    rows = list(result["functions"].items()) + [("all", result["latency"])]
+    for function, s in rows:
+        print(f"  {function:<14} {s['count']:>8} {s['p50_ms']:>9.2f} {s['p90_ms']:>9.2f} "
+              f"{s['p99_ms']:>9.2f} {s['p99.9_ms']:>9.2f} {s['max_ms']:>9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the socket book servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=8, help="clients (closed loop) or max connections (open loop)")
+    parser.add_argument("--rate", type=float, help="requests per second; switches to open-loop mode")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of load before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--keywords", help="comma-separated search keywords")
+    parser.add_argument("--no-keepalive", action="store_true", help="open a new connection for every request")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--encoding", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--json", help="write the results (with raw histograms) to this file")
+    args = parser.parse_args()
+
+    encoding = {name: enc for enc, name in codec.ENCODING_NAMES.items()}[args.encoding]
+    keywords = args.keywords.split(",") if args.keywords else DEFAULT_KEYWORDS
+    result = run(args.host, args.port, args.concurrency, args.duration, args.warmup, args.rate,
+                 args.mix, not args.no_keepalive, args.timeout, encoding, keywords)
+    print_result(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,45 @@
 import streamlit as st
-import socket, json, struct, time
+import time, sys, os
+
+# Frame header flags and encodings are shared with the servers
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import codec
+from rpc_client import BookClient
 
 # ---------- Networking helpers ----------
-def recv_exact(sock, n: int) -> bytes:
-    """Receive exactly n bytes from the socket"""
-    data = b""
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            raise ConnectionError("Connection closed")
-        data += packet
-    return data
+CONNECT_TIMEOUT = 3.0   # seconds to open a connection to the server
+CALL_TIMEOUT = 30.0     # seconds to wait for each response frame
+# Seconds an unused keep-alive connection stays open. The single-threaded
+# server_books.py serves nobody else while it is, so keep this short.
+IDLE_TIMEOUT = 5.0
+COMPRESSION = ["zstd", "lz4", "zlib"]  # offered to the server, best first
+
+@st.cache_resource
+def pooled_client(compress):
+    """One pooled client per compression setting, kept across reruns"""
+    return BookClient(connect_timeout=CONNECT_TIMEOUT, call_timeout=CALL_TIMEOUT, idle_timeout=IDLE_TIMEOUT,
+                      compression=COMPRESSION if compress else None)
+
+def get_client():
+    return pooled_client(st.session_state.get("compress", False))
 
-def rpc_call(server_ip, port, function, args):
-    """Send RPC request to server and get response"""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((server_ip, port))
-        request = json.dumps({"function": function, "args": args}).encode()
-        s.sendall(struct.pack("Q", len(request)))
-        s.sendall(request)
+def rpc_call(server_ip, port, function, args, encoding=codec.ENC_JSON):
+    """Send RPC request to server over a keep-alive connection and get response"""
+    return get_client().call(server_ip, port, function, args, encoding)
+
+def rpc_stream(server_ip, port, function, args, encoding=codec.ENC_JSON):
+    """Send a streamed RPC request and yield each chunk of rows as it arrives.
+
+    A server without streaming support answers with one normal frame; its
+    rows are then yielded as a single chunk.
+    """
+    return get_client().stream(server_ip, port, function, args, encoding)
 
-        resp_size_data = recv_exact(s, 8)
-        (resp_size,) = struct.unpack("Q", resp_size_data)
-        resp_data = recv_exact(s, resp_size).decode()
-        return json.loads(resp_data)
+def show_latency():
+    """Caption with the round-trip time of the last call"""
+    latency = get_client().last_latency_ms
+    if latency is not None:
+        st.caption(f"Round trip: {latency:.1f} ms")
 
 # ---------- Enhanced book card renderer ----------
 def show_books(books):
@@ -35,43 +51,62 @@ def show_books(books):
     st.success(f"Found {len(books)} book{'s' if len(books) != 1 else ''}!")
 
     for row in books:
-        bid, title, authors, avg, isbn, isbn13, lang, pages, ratings, reviews, pub_date, publisher = row
+        show_book(row)
 
-        # Create a container for each book
-        with st.container():
-            # Use columns for layout
-            col1, col2 = st.columns([3, 1])
+def show_books_stream(chunks):
+    """Render cards chunk by chunk, so the first books show before the rest arrive"""
+    status = st.empty()
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        status.info(f"Loaded {total} book{'s' if total != 1 else ''}...")
+        for row in chunk:
+            show_book(row)
+
+    if total:
+        status.success(f"Found {total} book{'s' if total != 1 else ''}!")
+    else:
+        status.warning("No books found. Try adjusting your search criteria.")
+
+def show_book(row):
+    """Render one book row as a styled card"""
+    bid, title, authors, avg, isbn, isbn13, lang, pages, ratings, reviews, pub_date, publisher = row
+
+    # Create a container for each book
+    with st.container():
+        # Use columns for layout
+        col1, col2 = st.columns([3, 1])
+        
+        with col1:
+            st.markdown(f"### {title}")
+            st.markdown(f"**Author:** {authors}")
+            st.markdown(f"**Publisher:** {publisher} ({pub_date})")
             
-            with col1:
-                st.markdown(f"### {title}")
-                st.markdown(f"**Author:** {authors}")
-                st.markdown(f"**Publisher:** {publisher} ({pub_date})")
-                
-            with col2:
-                if avg:
-                    if avg >= 4.5:
-                        st.success(f"⭐ {avg}")
-                    elif avg >= 4.0:
-                        st.info(f"⭐ {avg}")
-                    else:
-                        st.warning(f"⭐ {avg}")
+        with col2:
+            if avg:
+                if avg >= 4.5:
+                    st.success(f"⭐ {avg}")
+                elif avg >= 4.0:
+                    st.info(f"⭐ {avg}")
                 else:
-                    st.write("No rating")
-            
-            # Book details in columns
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Language", lang)
-            with col2:
-                st.metric("Pages", pages)
-            with col3:
-                st.metric("Ratings", f"{ratings:,}")
-            
-            # Additional info
-            st.markdown(f"**Reviews:** {reviews:,}")
-            st.markdown(f"**Book ID:** {bid} | **ISBN:** {isbn} | **ISBN13:** {isbn13}")
-            
-            st.divider()
+                    st.warning(f"⭐ {avg}")
+            else:
+                st.write("No rating")
+        
+        # Book details in columns
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Language", lang)
+        with col2:
+            st.metric("Pages", pages)
+        with col3:
+            st.metric("Ratings", f"{ratings:,}")
+        
+        # Additional info
+        st.markdown(f"**Reviews:** {reviews:,}")
+        st.markdown(f"**Book ID:** {bid} | **ISBN:** {isbn} | **ISBN13:** {isbn13}")
+        
+        st.divider()
 
 # ---------- Streamlit UI ----------
 st.set_page_config(page_title="Book Database Explorer", layout="wide")
@@ -250,6 +285,19 @@ with col1:
 with col2:
     port = st.number_input("Server Port", 8080, step=1, help="Enter the port number")
 
+encoding = st.selectbox(
+    "Wire encoding",
+    codec.available_encodings(),
+    format_func=lambda enc: codec.ENCODING_NAMES[enc],
+    help="MessagePack is smaller and faster to decode, but older servers only understand JSON"
+)
+
+st.checkbox(
+    "Compress large responses",
+    key="compress",
+    help="Saves bandwidth on slow links; small responses such as a single book are never compressed"
+)
+
 # Connection status
 st.markdown(f"""
     <div style="margin-top: 15px; padding: 10px 0;">
@@ -280,7 +328,8 @@ if action == "Get book by ID":
     if st.button("Fetch Book"):
         with st.spinner("Searching for your book..."):
             try:
-                result = rpc_call(server_ip, port, "get_book", [book_id])
+                result = rpc_call(server_ip, port, "get_book", [book_id], encoding)
+                show_latency()
                 if "error" in result:
                     st.error(f"Error: {result['error']}")
                 else:
@@ -293,18 +342,27 @@ if action == "Get book by ID":
 elif action == "Search books":
     st.markdown("#### Search through the collection")
     keyword = st.text_input("Search keyword", placeholder="Enter title, author, or any keyword...", help="Search across titles, authors, and other book details")
+    stream = st.checkbox("Show results as they arrive", value=True, help="Stream large result sets in chunks instead of waiting for the full list")
     if st.button("Search"):
         if keyword.strip():
-            with st.spinner(f"Searching for '{keyword}'..."):
+            if stream:
                 try:
-                    result = rpc_call(server_ip, port, "search_books", [keyword])
-                    books = result.get("result", [])
-                    if books:
-                        st.success(f"Found {len(books)} book{'s' if len(books) != 1 else ''}!")
-                    time.sleep(0.3)
-                    show_books(books)
+                    show_books_stream(rpc_stream(server_ip, port, "search_books", [keyword], encoding))
+                    show_latency()
                 except Exception as e:
                     st.error(f"Connection error: {str(e)}")
+            else:
+                with st.spinner(f"Searching for '{keyword}'..."):
+                    try:
+                        result = rpc_call(server_ip, port, "search_books", [keyword], encoding)
+                        show_latency()
+                        books = result.get("result", [])
+                        if books:
+                            st.success(f"Found {len(books)} book{'s' if len(books) != 1 else ''}!")
+                        time.sleep(0.3)
+                        show_books(books)
+                    except Exception as e:
+                        st.error(f"Connection error: {str(e)}")
         else:
             st.warning("Please enter a search keyword")
 
@@ -314,7 +372,8 @@ elif action == "List first 20":
     if st.button("List Books"):
         with st.spinner("Loading first 20 books..."):
             try:
-                result = rpc_call(server_ip, port, "list_books", [])
+                result = rpc_call(server_ip, port, "list_books", [], encoding)
+                show_latency()
                 books = result.get("result", [])
                 if books:
                     st.success(f"Loaded {len(books)} books successfully!")
@@ -0,0 +1,352 @@
+"""Reusable RPC client connections for the book servers.
+
+`BookClient` keeps a small pool of keep-alive connections per server, so
+repeated calls skip the TCP connect and the server-side accept (and, on
+server_mp, the fork). A pooled socket that the server has since closed is
+replaced transparently. A background thread closes sockets that have sat
+unused for `idle_timeout`, so a server isn't kept holding connections
+nobody is using. Each call's round-trip time is recorded:
+
+    client = BookClient()
+    book = client.call("127.0.0.1", 8080, "get_book", [1])
+    print(client.last_latency_ms)
+
+`MultiplexedConnection` pipelines many requests over one socket. Each call
+is tagged with a fresh request id (codec.FLAG_REQUEST_ID), so callers don't
+wait for each other's round trips. A reader thread hands every response
+frame to the call it answers, whatever order the server replies in:
+
+    conn = MultiplexedConnection("127.0.0.1", 8080)
+    futures = [conn.call_async("get_book", [i]) for i in range(1, 51)]
+    books = [f.result() for f in futures]     # ~1 round trip, not 50
+
+Both accept `compression`, a list of methods in order of preference (e.g.
+`["zstd", "lz4", "zlib"]`). Each new connection then starts with a `hello`
+request, and large responses arrive compressed (see server/compression.py).
+
+Calls take an optional `timeout_ms`, sent in the request envelope. The
+server drops the request once that much time has passed since it arrived
+and answers with code "deadline_exceeded" (see server/deadlines.py).
+"""
+import os, sys, socket, queue, threading, itertools, time
+from collections import deque
+from concurrent.futures import Future
+
+# Frame header flags and encodings are shared with the servers
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import codec, compression
+
+MAX_RESPONSE = 1 << 30  # cap on a decompressed response frame
+
+_END = object()
+
+def _envelope(function, args, timeout_ms=None, stream=False):
+    request = {"function": function, "args": args}
+    if stream:
+        request["stream"] = True
+    if timeout_ms is not None:
+        request["timeout_ms"] = timeout_ms
+    return request
+
+def _read_exact(rfile, n):
+    data = rfile.read(n)
+    if len(data) < n:
+        raise ConnectionError("Connection closed")
+    return data
+
+def _read_message(rfile):
+    """(request id or None, decoded message) for the next frame on a buffered socket file."""
+    size, flags = codec.unpack_header(_read_exact(rfile, codec.HEADER.size))
+    request_id = None
+    if flags & codec.FLAG_REQUEST_ID:
+        (request_id,) = codec.REQUEST_ID.unpack(_read_exact(rfile, codec.REQUEST_ID.size))
+    payload = compression.decompress(_read_exact(rfile, size), flags, MAX_RESPONSE)
+    return request_id, codec.decode(payload, codec.encoding_of(flags))
+
+def _hello(sock, rfile, methods):
+    """Negotiate compression for a new connection (no-op for an empty list)."""
+    if methods:
+        sock.sendall(codec.frame({"function": "hello", "args": [{"compression": list(methods)}]}))
+        _read_message(rfile)  # servers without hello answer with an error; compression stays off
+
+
+class _PooledSocket:
+    __slots__ = ("sock", "rfile", "last_used")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+        self.last_used = time.monotonic()
+
+    def read_message(self):
+        return _read_message(self.rfile)[1]
+
+    def close(self):
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class BookClient:
+    """Thread-safe client with a pool of keep-alive connections per server.
+
+    Calls from different threads each check out their own socket, so one
+    client object can be shared by the whole process (e.g. across Streamlit
+    reruns and sessions).
+    """
+
+    def __init__(self, max_idle=4, connect_timeout=3.0, call_timeout=30.0, idle_timeout=60.0,
+                 compression=None):
+        self.compression = compression        # methods offered in each connection's hello
+        self.max_idle = max_idle              # idle sockets kept per server
+        self.connect_timeout = connect_timeout
+        self.call_timeout = call_timeout      # max wait for each response frame
+        self.idle_timeout = idle_timeout      # close sockets idle longer than this
+        self._idle = {}                       # (host, port) -> deque of _PooledSocket, oldest first
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._reaper = None                   # started when the first socket is pooled
+        self._stop = threading.Event()
+
+    @property
+    def last_latency_ms(self):
+        """Round-trip time of this thread's most recent call (None before the first)."""
+        return getattr(self._local, "latency_ms", None)
+
+    def _checkout(self, server):
+        """(socket, reused) — an idle pooled socket if one is fresh enough, else a new one."""
+        now = time.monotonic()
+        conn, stale = None, []
+        with self._lock:
+            pool = self._idle.get(server)
+            while pool:
+                conn = pool.pop()  # the most recently used
+                if now - conn.last_used < self.idle_timeout:
+                    break
+                stale.append(conn)
+                conn = None
+        for old in stale:
+            old.close()
+        if conn is not None:
+            return conn, True
+        sock = socket.create_connection(server, timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.call_timeout)
+        conn = _PooledSocket(sock)
+        try:
+            _hello(conn.sock, conn.rfile, self.compression)
+        except OSError:
+            conn.close()
+            raise
+        return conn, False
+
+    def _checkin(self, server, conn):
+        conn.last_used = time.monotonic()
+        with self._lock:
+            pool = self._idle.setdefault(server, deque())
+            keep = len(pool) < self.max_idle
+            if keep:
+                pool.append(conn)
+                if self._reaper is None:
+                    self._reaper = threading.Thread(target=self._reap, name="book-client-reaper", daemon=True)
+                    self._reaper.start()
+        if not keep:
+            conn.close()
+
+    def _reap(self):
+        """Close pooled sockets as they pass idle_timeout, until close()."""
+        while True:
+            now = time.monotonic()
+            due = now + self.idle_timeout
+            stale = []
+            with self._lock:
+                for pool in self._idle.values():
+                    # Checked-in sockets are appended, so the oldest expire first
+                    while pool and now - pool[0].last_used >= self.idle_timeout:
+                        stale.append(pool.popleft())
+                    if pool:
+                        due = min(due, pool[0].last_used + self.idle_timeout)
+            for conn in stale:
+                conn.close()
+            if self._stop.wait(due - now):
+                return
+
+    def _exchange(self, server, frame):
+        """Send a request frame and read the first response frame.
+
+        If a reused keep-alive socket turns out to be dead, the request is
+        resent on another connection. The book RPCs are all reads, so
+        sending one twice is harmless.
+        """
+        while True:
+            conn, reused = self._checkout(server)
+            try:
+                conn.sock.sendall(frame)
+                return conn, conn.read_message()
+            except socket.timeout:
+                conn.close()
+                raise TimeoutError(f"No response from {server[0]}:{server[1]} within {self.call_timeout}s") from None
+            except OSError:
+                conn.close()
+                if not reused:
+                    raise
+
+    def call(self, host, port, function, args, encoding=codec.ENC_JSON, timeout_ms=None) -> dict:
+        """Send one request and return the decoded response."""
+        server = (host, int(port))
+        start = time.perf_counter()
+        conn, message = self._exchange(server, codec.frame(_envelope(function, args, timeout_ms), encoding))
+        self._local.latency_ms = (time.perf_counter() - start) * 1000
+        if message.get("code") == "busy":
+            conn.close()  # the server closes rejected connections
+        else:
+            self._checkin(server, conn)
+        return message
+
+    def stream(self, host, port, function, args, encoding=codec.ENC_JSON, timeout_ms=None):
+        """Yield each chunk of rows of a streamed response as it arrives.
+
+        The socket only goes back to the pool once the end-of-stream frame has
+        been read; an abandoned stream closes it instead.
+        """
+        server = (host, int(port))
+        start = time.perf_counter()
+        request = _envelope(function, args, timeout_ms, stream=True)
+        conn, message = self._exchange(server, codec.frame(request, encoding))
+        self._local.latency_ms = (time.perf_counter() - start) * 1000  # time to first chunk
+
+        finished = False
+        try:
+            while True:
+                if "error" in message:
+                    finished = message.get("end", False)
+                    raise RuntimeError(message["error"])
+                if "result" in message:  # server without streaming support
+                    finished = True
+                    yield message["result"]
+                    return
+                if message.get("end"):
+                    finished = True
+                    return
+                yield message["chunk"]
+                message = conn.read_message()
+        finally:
+            if finished:
+                self._checkin(server, conn)
+            else:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._idle = list(self._idle.values()), {}
+            reaper, self._reaper = self._reaper, None
+        if reaper is not None:
+            self._stop.set()
+            reaper.join()
+            self._stop.clear()
+        for pool in pools:
+            for conn in pool:
+                conn.close()
+
+
+class MultiplexedConnection:
+    """One socket shared by many concurrent callers."""
+
+    def __init__(self, host, port, encoding=codec.ENC_JSON, timeout=None, compression=None):
+        self.encoding = encoding
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self._rfile = self.sock.makefile("rb")
+        _hello(self.sock, self._rfile, compression)
+        self.sock.settimeout(None)  # the reader thread blocks until frames arrive
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = {}  # request id -> Future (calls) or Queue (streams)
+        self._ids = itertools.count(1)
+        self._closed = None  # exception that ended the connection
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _send(self, message, waiter):
+        with self._lock:
+            if self._closed is not None:
+                raise ConnectionError(f"Connection closed: {self._closed}")
+            request_id = next(self._ids) & 0xFFFFFFFF
+            self._pending[request_id] = waiter
+        frame = codec.tag_frame(codec.frame(message, self.encoding), request_id)
+        try:
+            with self._send_lock:
+                self.sock.sendall(frame)
+        except OSError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+
+    def call_async(self, function, args, timeout_ms=None) -> Future:
+        """Send a request without waiting; the Future resolves to the response dict."""
+        future = Future()
+        self._send(_envelope(function, args, timeout_ms), future)
+        return future
+
+    def call(self, function, args, timeout=None, timeout_ms=None) -> dict:
+        return self.call_async(function, args, timeout_ms).result(timeout)
+
+    def stream(self, function, args, timeout_ms=None):
+        """Yield each chunk of rows of a streamed response as it arrives."""
+        chunks = queue.Queue()
+        self._send(_envelope(function, args, timeout_ms, stream=True), chunks)
+        while True:
+            message = chunks.get()
+            if message is _END:
+                raise ConnectionError(f"Connection closed: {self._closed}")
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            if "result" in message:  # server without streaming support
+                yield message["result"]
+                return
+            if message.get("end"):
+                return
+            yield message["chunk"]
+
+    def _read_loop(self):
+        try:
+            while True:
+                request_id, message = _read_message(self._rfile)
+                self._dispatch(request_id, message)
+        except Exception as e:
+            self._fail_all(e)
+
+    def _dispatch(self, request_id, message):
+        if request_id is None:
+            # Untagged frames are connection-level errors (e.g. "server busy")
+            self._fail_all(RuntimeError(message.get("error", "Untagged response")))
+            return
+        with self._lock:
+            waiter = self._pending.get(request_id)
+            done = not isinstance(waiter, queue.Queue) or "chunk" not in message
+            if done:
+                self._pending.pop(request_id, None)
+        if isinstance(waiter, Future):
+            waiter.set_result(message)
+        elif waiter is not None:
+            waiter.put(message)
+
+    def _fail_all(self, exc):
+        with self._lock:
+            if self._closed is None:
+                self._closed = exc
+            pending, self._pending = self._pending, {}
+        for waiter in pending.values():
+            if isinstance(waiter, Future):
+                waiter.set_exception(ConnectionError(f"Connection closed: {exc}"))
+            else:
+                waiter.put(_END)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._reader.join(timeout=1)
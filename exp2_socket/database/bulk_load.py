@@ -0,0 +1,159 @@
+"""CSV parsing, batching and reporting shared by db_setup.py and db_setup_mysql.py.
+
+Rows are parsed and validated in Python before they reach the database. A
+row that can't be parsed (e.g. an unquoted comma in the authors field that
+shifts every later column) is written to the reject file with the reason,
+instead of being inserted with garbage in the wrong columns. Valid rows go
+to the database in batches of BATCH_SIZE, one transaction per batch; if the
+database refuses a batch (a duplicate bookID, say) that batch is retried row
+by row so only the offending rows are rejected.
+"""
+import csv, os, time, argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = os.path.join(HERE, "books.csv")
+REJECTS_PATH = os.path.join(HERE, "books_rejects.csv")
+BATCH_SIZE = 5000
+
+COLUMNS = ["bookID", "title", "authors", "average_rating", "isbn", "isbn13", "language_code",
+           "num_pages", "ratings_count", "text_reviews_count", "publication_date", "publisher"]
+
+# Secondary indexes, created once the data is in (index name, column)
+INDEXES = [("idx_books_isbn13", "isbn13")]
+
+
+def _number(row, column, kind):
+    value = (row.get(column) or "").strip()
+    if not value:
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f"{column}={value!r} is not a valid {kind.__name__}") from None
+
+def parse_row(row):
+    """Tuple of column values for one csv.DictReader row, or ValueError."""
+    if None in row:
+        raise ValueError(f"{len(row[None])} extra field(s); probably an unquoted comma")
+    row = {key.strip(): value for key, value in row.items()}  # the CSV header has "  num_pages"
+    book_id = _number(row, "bookID", int)
+    if book_id is None:
+        raise ValueError("missing bookID")
+    return (
+        book_id,
+        row.get("title"),
+        row.get("authors"),
+        _number(row, "average_rating", float),
+        row.get("isbn"),
+        row.get("isbn13"),
+        row.get("language_code"),
+        _number(row, "num_pages", int),
+        _number(row, "ratings_count", int),
+        _number(row, "text_reviews_count", int),
+        row.get("publication_date"),
+        row.get("publisher"),
+    )
+
+
+class Rejects:
+    """Reject file: the original CSV line number, the reason and the raw fields."""
+
+    def __init__(self, path=REJECTS_PATH):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def add(self, line, reason, fields):
+        if self._file is None:
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["line", "error"] + COLUMNS)
+        self._writer.writerow([line, reason] + list(fields))
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        elif os.path.exists(self.path):
+            os.remove(self.path)  # stale rejects from an earlier load
+
+
+class Progress:
+    """Running count of loaded rows and the load rate, printed every `every` rows."""
+
+    def __init__(self, every=100_000):
+        self.start = time.perf_counter()
+        self.loaded = 0
+        self.every = every
+        self._next = every
+
+    def add(self, n):
+        self.loaded += n
+        if self.loaded >= self._next:
+            self._next += self.every
+            print(f"    {self.loaded} rows, {self.rate():.0f} rows/s", flush=True)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def rate(self):
+        return self.loaded / self.elapsed() if self.elapsed() > 0 else 0.0
+
+    def report(self, rejects, what="rows"):
+        print(f"[✓] Loaded {self.loaded} {what} in {self.elapsed():.2f}s ({self.rate():.0f} rows/s)")
+        if rejects.count:
+            print(f"[!] {rejects.count} bad rows written to {rejects.path}")
+
+
+def read_books(csv_path, rejects):
+    """Yield (line number, values) for every valid row; bad rows go to `rejects`."""
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            try:
+                yield reader.line_num, parse_row(row)
+            except ValueError as e:
+                fields = [v for k, v in row.items() if k is not None] + row.get(None, [])
+                rejects.add(reader.line_num, str(e), fields)
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def insert_batches(conn, insert_sql, rows, rejects, progress, batch_size=BATCH_SIZE, errors=(Exception,)):
+    """executemany() each batch of (line, values) in its own transaction.
+
+    A batch the database rejects is rolled back and replayed one row at a
+    time, so only the rows that actually fail end up in the reject file.
+    """
+    cur = conn.cursor()
+    for batch in batches(rows, batch_size):
+        try:
+            cur.executemany(insert_sql, [values for _, values in batch])
+            conn.commit()
+            progress.add(len(batch))
+            continue
+        except errors:
+            conn.rollback()
+        for line, values in batch:
+            try:
+                cur.execute(insert_sql, values)
+                progress.add(1)
+            except errors as e:
+                rejects.add(line, str(e), values)
+        conn.commit()
+    cur.close()
+
+def arg_parser(description):
+    """Options shared by both seeders."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--csv", default=CSV_PATH, help="source CSV (default books.csv)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="rows per executemany/transaction")
+    parser.add_argument("--rejects", default=REJECTS_PATH, help="where rows that fail to load are written")
+    return parser
@@ -1,12 +1,33 @@
-import sqlite3, csv, os
+import sqlite3, os, sys
+import bulk_load
 
-db_path = os.path.join(os.path.dirname(__file__), "books.db")
-os.makedirs(os.path.dirname(db_path), exist_ok=True)
+sys.path.insert(0, os.path.join(bulk_load.HERE, "..", "server"))
+import snapshot
 
-conn = sqlite3.connect(db_path)
+db_path = os.path.join(bulk_load.HERE, "books.db")
+snap_path = os.path.join(bulk_load.HERE, "books.snap")
+
+parser = bulk_load.arg_parser("Build the SQLite copy of the catalog (books.db) from books.csv")
+parser.add_argument("--db", default=db_path, help="database file to (re)build (default books.db)")
+parser.add_argument("--snapshot", nargs="?", const=snap_path, metavar="PATH",
+                    help="also write a memory-mappable snapshot for BOOKDB_SNAPSHOT (default books.snap)")
+args = parser.parse_args()
+
+# Build into a temporary file and swap it in at the end, so servers reading
+# the old books.db (BOOKDB_BACKEND=sqlite) never see a half-loaded table
+tmp_path = args.db + ".loading"
+if os.path.exists(tmp_path):
+    os.remove(tmp_path)
+conn = sqlite3.connect(tmp_path, isolation_level="DEFERRED")
 cur = conn.cursor()
 
-cur.execute("DROP TABLE IF EXISTS books")
+# Nothing to protect until the file is complete: no rollback journal, no fsyncs
+cur.execute("PRAGMA journal_mode=OFF")
+cur.execute("PRAGMA synchronous=OFF")
+cur.execute("PRAGMA locking_mode=EXCLUSIVE")
+cur.execute("PRAGMA temp_store=MEMORY")
+cur.execute("PRAGMA cache_size=-65536")  # 64 MiB
+
 cur.execute("""
 CREATE TABLE books (
     bookID INTEGER PRIMARY KEY,
@@ -24,46 +45,27 @@ CREATE TABLE books (
 )
 """)
 
-csv_path = os.path.join(os.path.dirname(__file__), "books.csv")
-
-def safe_int(val):
-    try:
-        return int(val)
-    except:
-        return None
-
-def safe_float(val):
-    try:
-        return float(val)
-    except:
-        return None
-
-with open(csv_path, newline='', encoding="utf-8") as f:
-    reader = csv.DictReader(f)
-    for row in reader:
-        try:
-            cur.execute("""
-                INSERT INTO books (bookID, title, authors, average_rating, isbn, isbn13, language_code,
-                                   num_pages, ratings_count, text_reviews_count, publication_date, publisher)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                safe_int(row.get("bookID")),
-                row.get("title"),
-                row.get("authors"),
-                safe_float(row.get("average_rating")),
-                row.get("isbn"),
-                row.get("isbn13"),
-                row.get("language_code"),
-                safe_int(row.get("  num_pages") or row.get("num_pages")),  # handle weird header
-                safe_int(row.get("ratings_count")),
-                safe_int(row.get("text_reviews_count")),
-                row.get("publication_date"),
-                row.get("publisher")
-            ))
-        except Exception as e:
-            print(f"[!] Skipping bad row: {row}")
-            print("    Error:", e)
+rejects = bulk_load.Rejects(args.rejects)
+progress = bulk_load.Progress()
+bulk_load.insert_batches(
+    conn,
+    f"INSERT INTO books ({', '.join(bulk_load.COLUMNS)}) VALUES ({', '.join('?' * len(bulk_load.COLUMNS))})",
+    bulk_load.read_books(args.csv, rejects),
+    rejects, progress, args.batch, errors=(sqlite3.Error,),
+)
+rejects.close()
 
+# Secondary indexes are built once over the sorted data instead of row by row
+for name, column in bulk_load.INDEXES:
+    cur.execute(f"CREATE INDEX {name} ON books({column})")
+cur.execute("ANALYZE")
 conn.commit()
+if args.snapshot:
+    size = snapshot.write(cur.execute("SELECT * FROM books ORDER BY bookID").fetchall(), args.snapshot)
 conn.close()
-print(f"[✓] Database created at {db_path}")
+
+os.replace(tmp_path, args.db)
+progress.report(rejects)
+print(f"[✓] Database created at {args.db}")
+if args.snapshot:
+    print(f"[✓] Snapshot written to {args.snapshot} ({size / 2**20:.1f} MiB)")
@@ -0,0 +1,98 @@
+"""Frame header flags and payload encodings for the book RPC protocol.
+
+Every frame is still an 8-byte native `Q` length followed by the payload,
+but the top byte of that `Q` now carries flags. No real frame comes near
+2**56 bytes, so the old clients' headers (flags = 0) mean exactly what they
+always did: a JSON payload.
+
+The low nibble of the flag byte selects the payload encoding:
+
+    0  JSON         (default, what every existing client sends)
+    1  MessagePack  (needs the optional `msgpack` package)
+
+Encoding is chosen per frame by the client. The server decodes each request
+with the encoding its header names and answers in the same encoding, so no
+handshake is needed and old clients never see a binary frame.
+
+Flag 0x10 (FLAG_REQUEST_ID) means a 4-byte request id follows the header,
+before the payload. The length still counts only the payload. Tagged
+requests may be pipelined on one connection and answered out of order;
+every response frame (including each chunk of a stream) carries the id of
+the request it answers.
+
+Bits 0x60 name the compression method of the payload (0 = none, 0x20 =
+zlib, 0x40 = zstd, 0x60 = lz4). Servers only compress for connections that
+asked for it with a `hello` request; see compression.py.
+"""
+import json, struct
+
+try:
+    import msgpack
+except ImportError:  # optional: binary encoding is simply unavailable
+    msgpack = None
+
+HEADER = struct.Struct("Q")
+FLAG_SHIFT = 56
+LENGTH_MASK = (1 << FLAG_SHIFT) - 1
+
+ENC_JSON = 0
+ENC_MSGPACK = 1
+ENCODING_MASK = 0x0F
+ENCODING_NAMES = {ENC_JSON: "json", ENC_MSGPACK: "msgpack"}
+
+FLAG_REQUEST_ID = 0x10
+REQUEST_ID = struct.Struct("I")
+
+COMPRESSION_MASK = 0x60
+COMP_NONE = 0x00
+COMP_ZLIB = 0x20
+COMP_ZSTD = 0x40
+COMP_LZ4 = 0x60
+
+def available_encodings():
+    return [ENC_JSON] + ([ENC_MSGPACK] if msgpack is not None else [])
+
+def pack_header(length: int, flags: int = 0) -> bytes:
+    return HEADER.pack(length | (flags << FLAG_SHIFT))
+
+def unpack_header(header: bytes):
+    """(payload length, flags) from an 8-byte frame header."""
+    (value,) = HEADER.unpack(header)
+    return value & LENGTH_MASK, value >> FLAG_SHIFT
+
+def encoding_of(flags: int) -> int:
+    return flags & ENCODING_MASK
+
+def encode(message, encoding: int = ENC_JSON) -> bytes:
+    if encoding == ENC_JSON:
+        return json.dumps(message).encode()
+    if encoding == ENC_MSGPACK and msgpack is not None:
+        return msgpack.packb(message, use_bin_type=True)
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+def decode(payload: bytes, encoding: int = ENC_JSON):
+    if encoding == ENC_JSON:
+        return json.loads(payload)
+    if encoding == ENC_MSGPACK and msgpack is not None:
+        return msgpack.unpackb(payload, raw=False)
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+def frame(message, encoding: int = ENC_JSON) -> bytes:
+    """Header plus encoded payload, ready for one sendall()."""
+    payload = encode(message, encoding)
+    return pack_header(len(payload), encoding) + payload
+
+def tag_parts(frame: bytes, request_id):
+    """Buffers that make up `frame` tagged with `request_id`, without copying
+    the payload (just the frame itself for None)."""
+    if request_id is None:
+        return (frame,)
+    length, flags = unpack_header(frame[:HEADER.size])
+    return (pack_header(length, flags | FLAG_REQUEST_ID) + REQUEST_ID.pack(request_id),
+            memoryview(frame)[HEADER.size:])
+
+def tag_frame(frame: bytes, request_id) -> bytes:
+    """Copy of an encoded frame carrying `request_id` (returned as-is for None)."""
+    if request_id is None:
+        return frame
+    return b"".join(tag_parts(frame, request_id))
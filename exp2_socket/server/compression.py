@@ -0,0 +1,172 @@
+"""Compression of large response frames, negotiated per connection.
+
+Book rows repeat the same publishers, authors and languages over and over,
+so big search_books / list_books responses shrink several times over with
+any general-purpose compressor. A client that wants this sends a `hello`
+request once per connection, listing the methods it can decode in order of
+preference:
+
+    {"function": "hello", "args": [{"compression": ["zstd", "lz4", "zlib"]}]}
+
+The server picks the first one it also supports (zlib always; zstd and lz4
+if the optional `zstandard` / `lz4` packages are installed) and replies
+
+    {"result": {"compression": "zstd", "threshold": 4096, "encodings": [...]}}
+
+From then on, any response frame on that connection whose payload is at
+least BOOKDB_COMPRESS_THRESHOLD bytes is compressed and marked with the
+method in bits 0x60 of the header flags (see codec.py). Smaller frames such
+as a get_book reply, and frames that would not get smaller, go out as
+before. Clients that never say hello never see a compressed frame.
+"""
+import os, threading, time, zlib
+import codec
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # optional
+    lz4_frame = None
+
+COMPRESS_THRESHOLD = int(os.environ.get("BOOKDB_COMPRESS_THRESHOLD", "4096"))
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_zstd = threading.local()  # zstandard (de)compressors must not be shared between threads
+
+def _zstd_compress(data):
+    if not hasattr(_zstd, "compressor"):
+        _zstd.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return _zstd.compressor.compress(data)
+
+def _zstd_decompress(data, limit):
+    if not hasattr(_zstd, "decompressor"):
+        _zstd.decompressor = zstandard.ZstdDecompressor()
+    return _zstd.decompressor.decompress(data, max_output_size=limit)
+
+def _zlib_decompress(data, limit):
+    d = zlib.decompressobj()
+    out = d.decompress(data, limit)
+    if d.unconsumed_tail:
+        raise ValueError(f"Decompressed frame exceeds {limit} bytes")
+    return out
+
+def _lz4_decompress(data, limit):
+    out = lz4_frame.decompress(data)
+    if len(out) > limit:
+        raise ValueError(f"Decompressed frame exceeds {limit} bytes")
+    return out
+
+# method flag -> (name, compress(data), decompress(data, limit))
+METHODS = {codec.COMP_ZLIB: ("zlib", lambda data: zlib.compress(data, ZLIB_LEVEL), _zlib_decompress)}
+if zstandard is not None:
+    METHODS[codec.COMP_ZSTD] = ("zstd", _zstd_compress, _zstd_decompress)
+if lz4_frame is not None:
+    METHODS[codec.COMP_LZ4] = ("lz4", lz4_frame.compress, _lz4_decompress)
+BY_NAME = {name: method for method, (name, _, _) in METHODS.items()}
+
+
+class CompressionStats:
+    """Per-method totals, so the threshold can be tuned from the stats RPC."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}
+        self.skipped_small = 0
+
+    def record(self, method, raw, packed, cpu_ns):
+        with self._lock:
+            m = self._methods.setdefault(method, {"frames": 0, "incompressible": 0, "bytes_in": 0,
+                                                  "bytes_out": 0, "cpu_ns": 0})
+            m["frames"] += 1
+            m["incompressible"] += packed >= raw
+            m["bytes_in"] += raw
+            m["bytes_out"] += min(packed, raw)
+            m["cpu_ns"] += cpu_ns
+
+    def skip(self):
+        with self._lock:
+            self.skipped_small += 1
+
+    def stats(self):
+        with self._lock:
+            methods = {}
+            for method, m in self._methods.items():
+                methods[METHODS[method][0]] = {
+                    "frames": m["frames"], "incompressible": m["incompressible"],
+                    "bytes_in": m["bytes_in"], "bytes_out": m["bytes_out"],
+                    "ratio": round(m["bytes_in"] / m["bytes_out"], 2) if m["bytes_out"] else None,
+                    "cpu_ms": round(m["cpu_ns"] / 1e6, 2),
+                    "cpu_us_per_kb": round(m["cpu_ns"] / m["bytes_in"] * 1.024, 2) if m["bytes_in"] else None,
+                }
+            return {"threshold": COMPRESS_THRESHOLD, "available": [name for name, _, _ in METHODS.values()],
+                    "skipped_small": self.skipped_small, "methods": methods}
+
+
+totals = CompressionStats()
+
+def stats():
+    return totals.stats()
+
+def negotiate(offered) -> int:
+    """First method in the client's list that this server supports (COMP_NONE if none)."""
+    for name in offered or ():
+        if name in BY_NAME:
+            return BY_NAME[name]
+    return codec.COMP_NONE
+
+def _bad_hello(message):
+    return {"error": f"hello: {message}", "code": "bad_request"}, codec.COMP_NONE
+
+def handshake(request: bytes, encoding: int):
+    """(reply message, chosen method) if `request` is a hello, else None.
+    A malformed hello is answered with a bad_request error and no compression."""
+    if b"hello" not in request:  # cheap test before decoding anything
+        return None
+    try:
+        data = codec.decode(request, encoding)
+    except Exception:
+        return None
+    if not isinstance(data, dict) or data.get("function") != "hello":
+        return None
+    args = data.get("args")
+    if args is None:
+        args = []
+    if not isinstance(args, list) or len(args) > 1 or args and not isinstance(args[0], dict):
+        return _bad_hello("args must be [] or [{options}]")
+    offered = args[0].get("compression") if args else None
+    if offered is not None and not (isinstance(offered, list) and all(isinstance(m, str) for m in offered)):
+        return _bad_hello("compression must be a list of method names")
+    method = negotiate(offered)
+    reply = {"result": {"compression": METHODS[method][0] if method else None,
+                        "threshold": COMPRESS_THRESHOLD,
+                        "encodings": [codec.ENCODING_NAMES[e] for e in codec.available_encodings()]}}
+    return reply, method
+
+def compress_frame(frame: bytes, method: int) -> bytes:
+    """`frame` compressed with `method` if it is big enough to be worth it."""
+    if not method:
+        return frame
+    payload = memoryview(frame)[codec.HEADER.size:]
+    if len(payload) < COMPRESS_THRESHOLD:
+        totals.skip()
+        return frame
+    start = time.thread_time_ns()
+    packed = METHODS[method][1](payload)
+    totals.record(method, len(payload), len(packed), time.thread_time_ns() - start)
+    if len(packed) >= len(payload):
+        return frame
+    length, flags = codec.unpack_header(frame[:codec.HEADER.size])
+    return codec.pack_header(len(packed), flags | method) + packed
+
+def decompress(payload: bytes, flags: int, limit: int) -> bytes:
+    """Undo compress_frame for a payload read off the wire."""
+    method = flags & codec.COMPRESSION_MASK
+    if not method:
+        return payload
+    if method not in METHODS:
+        raise ValueError(f"Unsupported compression flag {method:#x}")
+    return METHODS[method][2](payload, limit)
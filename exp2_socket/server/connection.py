@@ -0,0 +1,272 @@
+"""Client connection handling shared by the exp4 servers.
+
+There are two ways to serve connections:
+
+* `serve(conn, addr)` runs one connection's request loop on the calling
+  thread until the client goes away. server_threaded starts a thread per
+  connection for it, and server_mp a process per connection.
+* `Dispatcher` serves any number of connections from a fixed set of worker
+  threads. Between requests a connection waits in a selector and holds no
+  thread, so idle keep-alive clients cost nothing. Once a request arrives,
+  the connection is queued for a worker. The worker reads and answers that
+  one request, then hands the connection back to the selector. Tagged
+  (pipelined) requests run on the same workers: the connection goes back to
+  the selector as soon as the request is read, so other workers can pick up
+  the next one, up to PIPELINE_DEPTH per connection. At most `maxsize`
+  connections may wait for a worker. A connection that would be queued
+  beyond that gets BUSY_FRAME and is closed.
+
+Each frame is a compression `hello`, an untagged request answered in order,
+or a tagged request that may be answered out of order.
+"""
+import queue, selectors, socket, threading, time
+from collections import deque
+import codec, framing, compression, metrics
+from handlers import build_response
+from pipeline import Pipeline, PIPELINE_DEPTH
+
+BUSY_FRAME = codec.frame({"error": "Server busy, try again later", "code": "busy"})
+SWEEP_INTERVAL = 1.0  # seconds between checks for connections idle past framing.IDLE_TIMEOUT
+
+
+def _answer_inline(pipeline, request, encoding, request_id, timer) -> bool:
+    """Answer a hello or an untagged request. False for a tagged request,
+    which the caller runs concurrently instead."""
+    hello = compression.handshake(request, encoding)
+    if hello is not None:
+        reply, pipeline.compression = hello
+        timer.function = "hello"
+        timer.finish(pipeline.send([codec.frame(reply, encoding)], request_id))
+    elif request_id is None:
+        pipeline.answer(request, encoding, timer)
+    else:
+        return False
+    return True
+
+def _fail(pipeline, timer, exc):
+    """Report an unexpected error to the client before its connection is closed."""
+    metrics.registry.connection_error(exc)
+    try:
+        timer.finish(pipeline.send([codec.frame({"error": str(exc)})]), error=True)
+    except OSError:
+        pass
+
+
+def serve(conn, addr):
+    """Serve one client connection on the calling thread until it closes."""
+    print(f"[Server] Client connected: {addr}")
+    metrics.registry.connection_opened()
+    with conn:
+        framing.configure(conn)
+        pipeline = Pipeline(conn, build_response)
+        while True:
+            timer = metrics.Request()
+            try:
+                request, flags, request_id = framing.recv_frame(conn, timer)
+                if not _answer_inline(pipeline, request, codec.encoding_of(flags), request_id, timer):
+                    # Tagged requests run concurrently and may be answered out of order
+                    pipeline.submit(request, codec.encoding_of(flags), request_id, timer)
+            except (ConnectionError, TimeoutError):
+                break  # client went away or sat idle past the timeout
+            except Exception as e:
+                _fail(pipeline, timer, e)
+                break
+        pipeline.close()
+    metrics.registry.connection_closed()
+    print(f"[Server] Client disconnected: {addr}")
+
+
+# ---------- Shared worker pool ----------
+class _Client:
+    """A connection served by a Dispatcher.
+
+    Its read side is always in exactly one place: parked in the selector,
+    queued for a worker, being read by a worker, or held back while `depth`
+    tagged requests are in flight. Only the holder of the read side hangs
+    up; the socket is closed once no tagged request is using it either.
+    """
+
+    def __init__(self, conn, addr, dispatcher):
+        self.conn = conn
+        self.addr = addr
+        self.dispatcher = dispatcher
+        self.pipeline = Pipeline(conn, build_response)  # only its send lock and answer helpers are used
+        self.idle_since = time.monotonic()
+        self.in_flight = 0     # tagged requests being answered
+        self._held = False     # read side held back until one of them finishes
+        self._hung_up = False  # no more reads; close once nothing is in flight
+        self._busy = False     # send BUSY_FRAME when closing
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def serve_one(self, ready_at):
+        """Read the request that made the connection readable at `ready_at`, and answer it."""
+        # Its clock starts when it became readable, so the wait for a worker
+        # counts towards its deadline and the shedding limit (deadlines.py)
+        timer = metrics.Request()
+        timer.begin(ready_at)
+        timer.lap("queue")
+        try:
+            # The header is already arriving, so don't let a stalled client hold the worker
+            request, flags, request_id = framing.recv_frame(self.conn, timer, framing.FRAME_TIMEOUT)
+            encoding = codec.encoding_of(flags)
+            if _answer_inline(self.pipeline, request, encoding, request_id, timer):
+                self.dispatcher.park(self)
+                return
+        except (ConnectionError, TimeoutError):
+            self.hang_up()
+            return
+        except Exception as e:
+            _fail(self.pipeline, timer, e)
+            self.hang_up()
+            return
+
+        # Tagged: let another worker read the next request while this one runs
+        with self._lock:
+            self.in_flight += 1
+            hold = self._held = self.in_flight >= self.dispatcher.depth
+        if not hold:
+            self.dispatcher.park(self)
+        self.pipeline.answer_tagged(request, encoding, request_id, timer)
+        with self._lock:
+            self.in_flight -= 1
+            resume, self._held = self._held, False
+            close = self._hung_up and not self.in_flight
+        if resume:
+            self.dispatcher.park(self)
+        if close:
+            self.close()
+
+    def hang_up(self, busy=False):
+        """Stop reading; close now, or when the last tagged request finishes."""
+        with self._lock:
+            self._hung_up = True
+            self._busy = busy
+            close = not self.in_flight
+        if close:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._busy:
+            try:
+                self.conn.settimeout(0)  # best effort: never block the caller on a client that isn't reading
+                self.conn.send(BUSY_FRAME)
+            except OSError:
+                pass
+        self.conn.close()
+        self.dispatcher.closed(self)
+
+
+class Dispatcher:
+    """Serves connections from a fixed set of worker threads; see the module docstring."""
+
+    def __init__(self, workers, maxsize, depth=PIPELINE_DEPTH):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.depth = depth
+        self._ready = queue.Queue(maxsize)   # (client, perf_counter() when it became readable)
+        self._parking = queue.SimpleQueue()  # clients handed back by other threads
+        self._selector = selectors.DefaultSelector()
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._waker.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1024)  # recent queue waits in ms, for percentiles
+        self._counts = {"open": 0, "dispatched": 0, "rejected": 0, "wait_max_ms": 0.0}
+
+    def start(self):
+        threading.Thread(target=self._poll, name="dispatcher", daemon=True).start()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"worker-{i}", daemon=True).start()
+        return self
+
+    def add(self, conn, addr):
+        """Take over a freshly accepted connection."""
+        print(f"[Server] Client connected: {addr}")
+        metrics.registry.connection_opened()
+        with self._lock:
+            self._counts["open"] += 1
+        framing.configure(conn)
+        self.park(_Client(conn, addr, self))
+
+    def park(self, client):
+        """Wait in the selector for the client's next request (callable from any thread)."""
+        self._parking.put(client)
+        try:
+            self._waker.send(b"\0")
+        except OSError:
+            pass  # socket buffer full: a wake-up is already pending
+
+    def closed(self, client):
+        with self._lock:
+            self._counts["open"] -= 1
+        metrics.registry.connection_closed()
+        print(f"[Server] Client disconnected: {client.addr}")
+
+    def _poll(self):
+        last_sweep = time.monotonic()
+        while True:
+            for key, _ in self._selector.select(SWEEP_INTERVAL):
+                if key.data is None:
+                    try:
+                        while self._wakeup.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._selector.unregister(key.fileobj)
+                self._dispatch(key.data)
+            while True:
+                try:
+                    client = self._parking.get_nowait()
+                except queue.Empty:
+                    break
+                client.idle_since = time.monotonic()
+                self._selector.register(client.conn, selectors.EVENT_READ, client)
+            now = time.monotonic()
+            if now - last_sweep >= SWEEP_INTERVAL:
+                last_sweep = now
+                self._sweep(now)
+
+    def _dispatch(self, client):
+        try:
+            self._ready.put_nowait((client, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._counts["rejected"] += 1
+            client.hang_up(busy=True)
+
+    def _sweep(self, now):
+        """Close connections that sat idle past framing.IDLE_TIMEOUT."""
+        for key in list(self._selector.get_map().values()):
+            client = key.data
+            if client is not None and not client.in_flight and now - client.idle_since > framing.IDLE_TIMEOUT:
+                self._selector.unregister(key.fileobj)
+                client.hang_up()
+
+    def _work(self):
+        while True:
+            client, ready_at = self._ready.get()
+            waited = (time.perf_counter() - ready_at) * 1000
+            with self._lock:
+                self._counts["dispatched"] += 1
+                self._waits.append(waited)
+                self._counts["wait_max_ms"] = max(self._counts["wait_max_ms"], waited)
+            client.serve_one(ready_at)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._counts)
+            waits = sorted(self._waits)
+        s["workers"] = self.workers
+        s["queued"] = self._ready.qsize()
+        s["maxsize"] = self.maxsize
+        if waits:
+            s["wait_p50_ms"] = waits[len(waits) // 2]
+            s["wait_p99_ms"] = waits[min(len(waits) - 1, int(len(waits) * 0.99))]
+        return s
@@ -0,0 +1,425 @@
+"""Shared storage access for the book servers.
+
+Two backends implement the same query_db / iter_query calls, chosen with
+BOOKDB_BACKEND so that all servers (and every worker process they fork)
+agree:
+
+mysql (default)
+    Every server process keeps a small pool of persistent connections
+    instead of opening one per query. Connections are checked out for one
+    query and returned, pinged before reuse when they have been idle for a
+    while, and recycled once they are older than the configured max age.
+
+sqlite
+    Serves straight from the books.db file built by database/db_setup.py,
+    for a same-host deployment with no network hop to MySQL, or to
+    benchmark the app tier on its own with no extra packages installed.
+    Each thread of each process gets its own read-only connection with the
+    file memory-mapped and prepared statements cached.
+
+Settings:
+
+    BOOKDB_BACKEND           mysql or sqlite (default mysql)
+    BOOKDB_HOST              MySQL host (default 127.0.0.1)
+    BOOKDB_POOL_SIZE         max MySQL connections per process (default 8)
+    BOOKDB_POOL_MAX_AGE      seconds before a connection is recycled (default 300)
+    BOOKDB_POOL_TIMEOUT      seconds to wait for a free connection (default 10)
+    BOOKDB_PREPARED          1 = run MySQL queries as server-side prepared
+                             statements, kept per connection (default 1)
+    BOOKDB_SQLITE_PATH       SQLite file (default ../database/books.db)
+    BOOKDB_SQLITE_MMAP       bytes of the file to memory-map (default 268435456)
+    BOOKDB_SQLITE_IMMUTABLE  1 = promise the file never changes while serving,
+                             which skips all locking (default 0)
+"""
+import os, queue, sqlite3, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    import mysql.connector
+except ImportError:  # only needed by the mysql backend
+    mysql = None
+
+BACKEND = os.environ.get("BOOKDB_BACKEND", "mysql")
+
+DB_CONFIG = {
+    "host": os.environ.get("BOOKDB_HOST", "127.0.0.1"),  # PC1's IP when DB is remote
+    "user": "bookuser",
+    "password": "password123",
+    "database": "bookdb",
+    # Pooled connections live across requests; without autocommit every read
+    # would stay inside one long transaction and keep seeing an old snapshot.
+    "autocommit": True,
+}
+
+POOL_SIZE = int(os.environ.get("BOOKDB_POOL_SIZE", "8"))
+POOL_MAX_AGE = float(os.environ.get("BOOKDB_POOL_MAX_AGE", "300"))
+POOL_TIMEOUT = float(os.environ.get("BOOKDB_POOL_TIMEOUT", "10"))
+PING_AFTER_IDLE = 30.0  # only health-check connections that sat idle this long
+MYSQL_PREPARED = os.environ.get("BOOKDB_PREPARED", "1") != "0"
+MYSQL_STATEMENTS = 64  # prepared statements kept per MySQL connection
+
+SQLITE_PATH = os.environ.get("BOOKDB_SQLITE_PATH",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database", "books.db"))
+SQLITE_MMAP = int(os.environ.get("BOOKDB_SQLITE_MMAP", str(256 * 1024 * 1024)))
+SQLITE_IMMUTABLE = os.environ.get("BOOKDB_SQLITE_IMMUTABLE", "0") == "1"
+SQLITE_STATEMENTS = 256  # prepared statements cached per connection
+
+
+# Errors after which a pooled connection can't be trusted any more
+_BROKEN_ERRORS = ((mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+                  if mysql is not None else ())
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+class _Pooled:
+    __slots__ = ("conn", "created", "last_used", "statements")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = self.last_used = time.monotonic()
+        self.statements = OrderedDict()  # SQL text -> prepared cursor, least recently used first
+
+
+class ConnectionPool:
+    """Thread-safe pool of at most `size` MySQL connections."""
+
+    def __init__(self, size=POOL_SIZE, max_age=POOL_MAX_AGE, timeout=POOL_TIMEOUT, connect=None):
+        self.size = size
+        self.max_age = max_age
+        self.timeout = timeout
+        self._connect = connect or (lambda: mysql.connector.connect(**DB_CONFIG))
+        self._idle = queue.LifoQueue()  # LIFO keeps the warmest connections busy
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0, "timeouts": 0, "opened": 0, "recycled": 0, "broken": 0,
+            "wait_total_ms": 0.0, "wait_max_ms": 0.0, "in_use": 0,
+        }
+
+    def _open(self):
+        item = _Pooled(self._connect())
+        with self._lock:
+            self._stats["opened"] += 1
+        return item
+
+    def _discard(self, item, reason):
+        try:
+            item.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats[reason] += 1
+
+    def _usable(self, item, now):
+        if now - item.created > self.max_age:
+            self._discard(item, "recycled")
+            return False
+        if now - item.last_used > PING_AFTER_IDLE:
+            try:
+                item.conn.ping(reconnect=False)
+            except Exception:
+                self._discard(item, "broken")
+                return False
+        return True
+
+    def acquire(self):
+        """Check out a connection, blocking up to `timeout` seconds for a free slot."""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"No DB connection free after {self.timeout}s (pool size {self.size})")
+        waited = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_total_ms"] += waited
+            self._stats["wait_max_ms"] = max(self._stats["wait_max_ms"], waited)
+
+        try:
+            now = time.monotonic()
+            while True:
+                try:
+                    item = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._open()
+                if self._usable(item, now):
+                    return item
+        except BaseException:
+            self._give_back_slot()
+            raise
+
+    def release(self, item, broken=False):
+        """Return a connection to the pool; broken ones are closed instead."""
+        if broken:
+            self._discard(item, "broken")
+        else:
+            item.last_used = time.monotonic()
+            self._idle.put(item)
+        self._give_back_slot()
+
+    def _give_back_slot(self):
+        with self._lock:
+            self._stats["in_use"] -= 1
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        with self.pooled() as item:
+            yield item.conn
+
+    @contextmanager
+    def pooled(self):
+        """Like connection(), but yields the pool entry (connection plus its statements)."""
+        item = self.acquire()
+        try:
+            yield item
+        except _BROKEN_ERRORS:
+            self.release(item, broken=True)
+            raise
+        except BaseException:
+            self.release(item)
+            raise
+        else:
+            self.release(item)
+
+    def stats(self):
+        """Snapshot of pool counters, including checkout wait times in ms."""
+        with self._lock:
+            s = dict(self._stats)
+        s["size"] = self.size
+        s["idle"] = self._idle.qsize()
+        s["wait_avg_ms"] = s["wait_total_ms"] / s["checkouts"] if s["checkouts"] else 0.0
+        return s
+
+    def close(self):
+        while True:
+            try:
+                item = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                item.conn.close()
+            except Exception:
+                pass
+
+
+# ---------- Per-process pool ----------
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Return this process's pool, creating it on first use.
+
+    The pool is keyed on the PID so that a forked child never reuses sockets
+    it inherited from its parent; it lazily builds a pool of its own instead.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool()
+                _pool_pid = pid
+    return _pool
+
+
+
+# ---------- Backends ----------
+class MySQLBackend:
+    """Queries on this process's connection pool.
+
+    With BOOKDB_PREPARED on, each statement text is prepared on the server
+    the first time a connection runs it. The prepared cursor is kept with the
+    connection, so later runs only send the parameters. The handlers' SQL is
+    fixed text with %s placeholders, so the set of statements stays small.
+    """
+    name = "mysql"
+
+    def __init__(self, prepared=MYSQL_PREPARED):
+        if mysql is None:
+            raise ImportError("BOOKDB_BACKEND=mysql needs mysql-connector-python installed")
+        self.prepared = prepared
+        self._lock = threading.Lock()
+        self._stats = {"prepared": 0, "reused": 0, "evicted": 0}
+
+    def _cursor(self, item, query):
+        """A cursor for `query` on this connection: its prepared cursor when enabled."""
+        if not self.prepared:
+            return item.conn.cursor()
+        cur = item.statements.get(query)
+        if cur is not None:
+            item.statements.move_to_end(query)
+            with self._lock:
+                self._stats["reused"] += 1
+            return cur
+        if len(item.statements) >= MYSQL_STATEMENTS:
+            _, oldest = item.statements.popitem(last=False)
+            oldest.close()  # deallocates the statement on the server
+            with self._lock:
+                self._stats["evicted"] += 1
+        cur = item.statements[query] = item.conn.cursor(prepared=True)
+        with self._lock:
+            self._stats["prepared"] += 1
+        return cur
+
+    def query(self, query, params=()):
+        """Run a query on a pooled connection and return all rows."""
+        with get_pool().pooled() as item:
+            cur = self._cursor(item, query)
+            try:
+                cur.execute(query, params)
+                return cur.fetchall()
+            finally:
+                if not self.prepared:
+                    cur.close()
+
+    def iter_query(self, query, params=(), batch=500):
+        """Yield rows as they are read off the wire instead of buffering them all.
+
+        The connection stays checked out until the iterator is exhausted. If it
+        is abandoned half-way, unread rows are still pending on the connection,
+        so it is closed rather than returned to the pool.
+        """
+        pool = get_pool()
+        item = pool.acquire()
+        finished = False
+        try:
+            cur = self._cursor(item, query)
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    break
+                yield from rows
+            if not self.prepared:
+                cur.close()
+            finished = True
+        finally:
+            pool.release(item, broken=not finished)
+
+    def stats(self):
+        with self._lock:
+            statements = dict(self._stats, enabled=self.prepared)
+        return dict(get_pool().stats(), statements=statements)
+
+    def close(self):
+        get_pool().close()
+
+
+@lru_cache(maxsize=None)
+def _sqlite_sql(query):
+    """MySQL-style %s placeholders as SQLite ? ones. Cached, so each query
+    maps to one string and hits the connection's statement cache."""
+    return query.replace("%s", "?")
+
+class SQLiteBackend:
+    """Read-only queries on a local SQLite file, one connection per thread.
+
+    sqlite3 connections are cheap but must not be shared between threads
+    that use them at once, so each thread opens its own on first use. With
+    mmap_size set, pages are read straight from the OS page cache (shared by
+    every connection and every forked worker) instead of being copied into
+    each connection's own cache. Connections are opened with mode=ro and
+    PRAGMA query_only, and with immutable=1 when BOOKDB_SQLITE_IMMUTABLE is
+    set.
+    """
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH, mmap_size=SQLITE_MMAP, immutable=SQLITE_IMMUTABLE):
+        self.path = os.path.abspath(path)
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"{self.path} not found; run database/db_setup.py first")
+        self.mmap_size = mmap_size
+        self.immutable = immutable
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._stats = {"connections": 0, "queries": 0}
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            uri = f"file:{self.path}?mode=ro" + ("&immutable=1" if self.immutable else "")
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   cached_statements=SQLITE_STATEMENTS)
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+                self._stats["connections"] += 1
+        with self._lock:
+            self._stats["queries"] += 1
+        return conn
+
+    def query(self, query, params=()):
+        return self._connection().execute(_sqlite_sql(query), params).fetchall()
+
+    def iter_query(self, query, params=(), batch=500):
+        cur = self._connection().execute(_sqlite_sql(query), params)
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            yield from rows
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s.update(path=self.path, mmap_size=self.mmap_size, immutable=self.immutable)
+        return s
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+# Backend name -> class; BOOKDB_BACKEND picks one
+BACKENDS = {"mysql": MySQLBackend, "sqlite": SQLiteBackend}
+
+_backend = None
+_backend_pid = None
+
+def get_backend():
+    """This process's backend, created on first use (and again after a fork)."""
+    global _backend, _backend_pid
+    pid = os.getpid()
+    if _backend is None or _backend_pid != pid:
+        with _pool_lock:
+            if _backend is None or _backend_pid != pid:
+                if BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown BOOKDB_BACKEND {BACKEND!r} (expected one of {', '.join(BACKENDS)})")
+                _backend = BACKENDS[BACKEND]()
+                _backend_pid = pid
+    return _backend
+
+def query_db(query, params=()):
+    """Run a query and return all rows."""
+    return get_backend().query(query, params)
+
+def iter_query(query, params=(), batch=500):
+    """Iterate over a query's rows without buffering them all."""
+    return get_backend().iter_query(query, params, batch)
+
+def stats():
+    """Backend name plus its counters (pool counters for MySQL)."""
+    backend = get_backend()
+    return dict(backend.stats(), backend=backend.name)
+
+def close():
+    """Close this process's connections, e.g. before forking workers."""
+    if _backend is not None and _backend_pid == os.getpid():
+        _backend.close()
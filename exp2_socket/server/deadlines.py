@@ -0,0 +1,95 @@
+"""Client deadlines and queue-time load shedding.
+
+A request may carry `"timeout_ms": n` in its envelope: how long the client
+is willing to wait for the answer. It is counted on the server's clock from
+the moment the request header arrived, so client and server clocks never
+need to agree. On the servers that run a shared worker pool
+(connection.Dispatcher) it counts from when the request's connection became
+readable, so time spent queued for a worker is included. The server checks
+it at three points:
+
+    dequeue  when a worker picks the request up (build_response starts)
+    db       right before the handler runs, after a response cache miss
+    send     before each response frame is written
+
+Work whose deadline has passed is dropped there and answered with
+`{"error": ..., "code": "deadline_exceeded"}`. A client that already gave up
+never reads that answer, but the server stops spending DB time on it.
+
+BOOKDB_SHED_QUEUE_MS adds a shedding policy for requests with or without a
+deadline. A request that waited longer than this for a worker (the `queue`
+stage in metrics.py: queued for a pool thread, a pipeline slot or the
+asyncio DB executor) is answered at once with
+`{"error": ..., "code": "shed"}` instead of being run. Under
+overload the backlog then stays short. The requests that do run finish
+within roughly the limit plus their own service time, instead of everyone
+waiting behind a growing queue. 0 (the default) turns shedding off.
+
+Every dropped request is counted per RPC and reason in the metrics registry.
+"""
+import os, time
+import codec, metrics
+
+SHED_QUEUE_MS = float(os.environ.get("BOOKDB_SHED_QUEUE_MS", "0"))
+MAX_TIMEOUT_MS = 3_600_000
+
+
+def _expired(timer, stage):
+    late_ms = (time.perf_counter() - timer.deadline) * 1000
+    if late_ms < 0:
+        return None
+    metrics.registry.request_dropped(timer.function, "expired_" + stage)
+    return {"error": f"Deadline exceeded {late_ms:.0f} ms ago, dropped before {stage}",
+            "code": "deadline_exceeded"}
+
+def admit(timer, data):
+    """Start the request's deadline and apply the dequeue checks. Returns the
+    error response for a request that must not run, or None."""
+    timeout_ms = data.get("timeout_ms")
+    if timeout_ms is not None:
+        if isinstance(timeout_ms, bool) or not isinstance(timeout_ms, (int, float)) \
+                or not 0 < timeout_ms <= MAX_TIMEOUT_MS:
+            return {"error": f"timeout_ms must be a number between 0 and {MAX_TIMEOUT_MS}", "code": "bad_request"}
+        timer.expire_after(timeout_ms / 1000)
+        expired = _expired(timer, "dequeue")
+        if expired is not None:
+            return expired
+    if SHED_QUEUE_MS:
+        waited_ms = timer.stages.get("queue", 0.0) * 1000
+        if waited_ms > SHED_QUEUE_MS:
+            metrics.registry.request_dropped(timer.function, "shed")
+            return {"error": f"Server overloaded: request waited {waited_ms:.0f} ms for a worker "
+                             f"(limit {SHED_QUEUE_MS:g} ms)", "code": "shed"}
+    return None
+
+def check(timer, stage):
+    """The error response if the request's deadline has passed, else None."""
+    if timer.deadline is None:
+        return None
+    return _expired(timer, stage)
+
+def guard(frames, encoding, timer):
+    """The response frames, with the send check applied before each one. A
+    stream whose deadline passes mid-way ends with an error frame. Responses
+    that are already errors go out unchanged."""
+    if timer.deadline is None or timer.error:
+        return frames
+    if isinstance(frames, tuple):
+        expired = _expired(timer, "send")
+        if expired is None:
+            return frames
+        timer.error = True
+        return (codec.frame(expired, encoding),)
+    return _guard_stream(frames, encoding, timer)
+
+def _guard_stream(frames, encoding, timer):
+    try:
+        for frame in frames:
+            expired = _expired(timer, "send")
+            if expired is not None:
+                timer.error = True
+                yield codec.frame(dict(expired, end=True), encoding)
+                return
+            yield frame
+    finally:
+        frames.close()
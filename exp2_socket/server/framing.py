@@ -0,0 +1,94 @@
+"""Socket I/O for length-prefixed frames, shared by all the book servers.
+
+Replaces the per-server `recv_exact` copies, which grew the payload with
+`data += packet` (quadratic copying for large frames) and trusted whatever
+length the client sent. Here:
+
+* frames are read with `recv_into` straight into one preallocated buffer;
+* a frame is sent with one scatter-gather `sendmsg` (header, optional
+  request id and payload as separate buffers, nothing concatenated);
+* accepted sockets get TCP_NODELAY, so small responses are not held back
+  by Nagle's algorithm;
+* a header announcing more than BOOKDB_MAX_FRAME bytes is rejected before
+  anything is allocated;
+* a client gets BOOKDB_IDLE_TIMEOUT seconds to start its next request and
+  BOOKDB_FRAME_TIMEOUT seconds to finish sending one it has started.
+"""
+import os, socket
+import codec, compression
+
+MAX_FRAME_SIZE = int(os.environ.get("BOOKDB_MAX_FRAME", str(16 * 1024 * 1024)))
+IDLE_TIMEOUT = float(os.environ.get("BOOKDB_IDLE_TIMEOUT", "300"))
+FRAME_TIMEOUT = float(os.environ.get("BOOKDB_FRAME_TIMEOUT", "30"))
+
+
+class FrameTooLarge(ValueError):
+    """A frame header announced more than MAX_FRAME_SIZE bytes."""
+
+
+def configure(sock):
+    """Socket options for a freshly accepted client connection."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.settimeout(IDLE_TIMEOUT)
+
+def recv_exact(sock, n: int) -> bytearray:
+    """Receive exactly n bytes from the socket into a single buffer."""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        got = sock.recv_into(view[pos:], n - pos)
+        if not got:
+            raise ConnectionError("Connection closed")
+        pos += got
+    return buf
+
+def check_size(size: int):
+    if size > MAX_FRAME_SIZE:
+        raise FrameTooLarge(f"Frame of {size} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+
+def recv_frame(sock, timer=None, header_timeout=IDLE_TIMEOUT):
+    """Read one request frame: (payload, flags, request id or None).
+
+    Waits up to `header_timeout` for the header, then FRAME_TIMEOUT for the
+    rest. A metrics.Request `timer` is started once the header is in.
+    """
+    sock.settimeout(header_timeout)
+    size, flags = codec.unpack_header(recv_exact(sock, codec.HEADER.size))
+    if timer is not None:
+        timer.begin()
+    check_size(size)
+    sock.settimeout(FRAME_TIMEOUT)
+    request_id = None
+    if flags & codec.FLAG_REQUEST_ID:
+        (request_id,) = codec.REQUEST_ID.unpack(recv_exact(sock, codec.REQUEST_ID.size))
+    payload = recv_exact(sock, size)
+    if timer is not None:
+        timer.received(codec.HEADER.size + (request_id is not None) * codec.REQUEST_ID.size + size)
+    return payload, flags, request_id
+
+def send_parts(sock, parts) -> int:
+    """Send several buffers as one frame with as few syscalls as possible;
+    returns the number of bytes sent."""
+    total = sum(len(p) for p in parts)
+    if not hasattr(sock, "sendmsg"):  # e.g. Windows
+        sock.sendall(b"".join(parts))
+        return total
+    views = [memoryview(p) for p in parts if len(p)]
+    while views:
+        sent = sock.sendmsg(views)
+        # Drop whatever was fully sent and trim a partially sent buffer
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+    return total
+
+def send_frame(sock, frame: bytes, request_id=None, method=codec.COMP_NONE) -> int:
+    """Send an encoded frame, tagged with request_id if given and compressed
+    with the connection's negotiated method if it is large enough. Returns
+    the bytes written."""
+    return send_parts(sock, codec.tag_parts(compression.compress_frame(frame, method), request_id))
@@ -0,0 +1,404 @@
+"""The book RPCs, and the one dispatch path every server uses.
+
+Each RPC is registered with `@rpc(name, *params, sql=..., stream=...)`:
+
+* `params` is its argument schema: one `Arg(name, convert)` per positional
+  argument. `convert` checks and normalizes the value, and optional
+  arguments have a default. Requests are validated before any handler
+  runs, so bad arguments never reach the database. They are answered with
+  `{"error": ..., "code": "bad_request"}`.
+* `sql` names the statements in SQL that the handler runs. The text of each
+  statement is fixed, so the database prepares it once per connection and
+  reuses it. The MySQL backend uses server-side prepared cursors; SQLite
+  uses its per-connection statement cache (see db.py). `get_books` pads
+  its IN list to a power of two so that it needs a handful of statements,
+  not one per batch size.
+* `stream` is the generator used when the request asks for `"stream": true`.
+* `coalesce=True` lets concurrent identical queries (same SQL and
+  parameters) issued by the RPC share one execution (see singleflight.py).
+  Handlers run their queries through `fetch`, which does this when the
+  current RPC coalesces. Streamed queries are never shared.
+  BOOKDB_COALESCE=0 turns it off for every RPC.
+
+`handle_request` looks the RPC up, binds its arguments and calls it.
+`build_response` adds decoding, the response cache and encoding. It is
+what the servers' connection loops call. A server can register extra
+sections for the `stats` RPC in STATS_SOURCES, or replace an RPC by
+registering the same name again.
+"""
+import os
+from contextvars import ContextVar
+from functools import lru_cache
+from itertools import islice
+from db import query_db
+from response_cache import cache, request_key
+from singleflight import SingleFlight
+import db, search_index, snapshot, paging, codec, compression, metrics, profiler, deadlines
+
+MAX_BATCH = 1000  # ids per get_books call / calls per multi envelope
+MAX_KEYWORD = 200  # characters in a search keyword
+COALESCE_ENABLED = os.environ.get("BOOKDB_COALESCE", "1") != "0"
+
+SQL = {
+    "book_by_id": "SELECT * FROM books WHERE bookID=%s",
+    "books_by_ids": "SELECT * FROM books WHERE bookID IN ({ids})",  # see in_list_sql()
+    "search": "SELECT * FROM books WHERE title LIKE %s OR authors LIKE %s",
+    "search_page": "SELECT * FROM books WHERE (title LIKE %s OR authors LIKE %s) AND bookID > %s "
+                   "ORDER BY bookID LIMIT %s",
+    "first_books": "SELECT * FROM books LIMIT 20",
+}
+
+
+class ArgumentError(ValueError):
+    """A request's arguments don't match the RPC's schema."""
+
+
+# ---------- Argument types ----------
+REQUIRED = object()
+
+def integer(value):
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise TypeError(f"expected an integer, got {value!r}")
+    return int(value)
+
+def search_keyword(value):
+    if not isinstance(value, str):
+        raise TypeError(f"expected a string, got {type(value).__name__}")
+    if len(value) > MAX_KEYWORD:
+        raise ValueError(f"longer than {MAX_KEYWORD} characters")
+    return value
+
+def text(value):
+    if not isinstance(value, str):
+        raise TypeError(f"expected a string, got {type(value).__name__}")
+    return value
+
+def id_list(value):
+    if not isinstance(value, list):
+        raise TypeError(f"expected a list of ids, got {type(value).__name__}")
+    if len(value) > MAX_BATCH:
+        raise ValueError(f"at most {MAX_BATCH} ids per call")
+    return [integer(v) for v in value]
+
+def call_list(value):
+    if not isinstance(value, list):
+        raise TypeError(f"expected a list of calls, got {type(value).__name__}")
+    if len(value) > MAX_BATCH:
+        raise ValueError(f"at most {MAX_BATCH} calls per multi envelope")
+    return value
+
+def mapping(value):
+    if not isinstance(value, dict):
+        raise TypeError(f"expected an object, got {type(value).__name__}")
+    return value
+
+def anything(value):
+    return value
+
+def _size(options, key, default, limit):
+    value = options.get(key)
+    if value is None:
+        return default
+    size = integer(value)
+    if not 1 <= size <= limit:
+        raise ValueError(f"{key} must be between 1 and {limit}, got {size}")
+    return size
+
+def paging_options(value):
+    """Paging and streaming options -> {"page_size", "chunk_size", "after_id"}, defaults filled in."""
+    options = mapping(value)
+    return {"page_size": _size(options, "page_size", paging.DEFAULT_PAGE_SIZE, paging.MAX_PAGE_SIZE),
+            "chunk_size": _size(options, "chunk_size", paging.STREAM_CHUNK_ROWS, paging.MAX_CHUNK_ROWS),
+            "after_id": paging.decode_cursor(options.get("cursor"))}
+
+
+class Arg:
+    def __init__(self, name, convert, default=REQUIRED):
+        self.name = name
+        self.convert = convert
+        self.default = default
+
+
+class RPC:
+    def __init__(self, name, func, params, sql, stream, coalesce):
+        self.name = name
+        self.func = func
+        self.params = params
+        self.sql = sql
+        self.stream = stream
+        self.coalesce = coalesce
+
+    def bind(self, args):
+        """Validated argument values, in order, with defaults filled in."""
+        if not isinstance(args, list):
+            raise ArgumentError(f"{self.name}: args must be a list")
+        if len(args) > len(self.params):
+            raise ArgumentError(f"{self.name} takes at most {len(self.params)} argument(s), got {len(args)}")
+        values = []
+        for i, param in enumerate(self.params):
+            if i >= len(args):
+                if param.default is REQUIRED:
+                    raise ArgumentError(f"{self.name}: missing argument {param.name}")
+                values.append(param.default)
+                continue
+            try:
+                values.append(param.convert(args[i]))
+            except (TypeError, ValueError) as e:
+                raise ArgumentError(f"{self.name}: bad {param.name}: {e}") from None
+        return values
+
+    def describe(self):
+        return {"args": [p.name + ("" if p.default is REQUIRED else "?") for p in self.params],
+                "sql": list(self.sql), "stream": self.stream is not None, "coalesce": self.coalesce}
+
+
+HANDLERS = {}  # RPC name -> RPC
+STATS_SOURCES = {}  # extra stats RPC sections: name -> callable
+
+def rpc(name, *params, sql=(), stream=None, coalesce=False):
+    """Register the decorated function as RPC `name` (see the module docstring)."""
+    unknown = [s for s in sql if s not in SQL]
+    if unknown:
+        raise KeyError(f"{name}: unknown SQL statement(s) {unknown}")
+
+    def register(func):
+        HANDLERS[name] = RPC(name, func, params, tuple(sql), stream, coalesce and COALESCE_ENABLED)
+        return func
+    return register
+
+
+# ---------- Queries ----------
+flights = SingleFlight()
+_coalescing = ContextVar("coalescing", default=None)  # name of the running RPC, if it coalesces
+
+def fetch(query, params=()):
+    """query_db(query, params), shared with an identical query already in
+    flight when the running RPC coalesces. The rows must not be modified."""
+    function = _coalescing.get()
+    if function is None:
+        return query_db(query, params)
+    rows, shared = flights.do((query, params), query_db, query, params)
+    metrics.registry.query_flight(function, shared)
+    return rows
+
+@lru_cache(maxsize=None)
+def in_list_sql(size):
+    return SQL["books_by_ids"].format(ids=", ".join(["%s"] * size))
+
+def books_by_ids(ids):
+    """Rows for the given ids, in one query whose IN list is padded to a power of two."""
+    size = 1 << (len(ids) - 1).bit_length()
+    return fetch(in_list_sql(size), tuple(ids) + (ids[-1],) * (size - len(ids)))
+
+def search_rows(keyword, after_id=0, limit=None, page_rows=paging.STREAM_CHUNK_ROWS):
+    """Iterate books matching keyword in bookID order, starting after after_id.
+    Without a limit, SQL rows are read page_rows at a time (see search_pages)."""
+    rows = search_index.iter_search(keyword, after_id)
+    if rows is not None:
+        return rows if limit is None else islice(rows, limit)
+    pattern = f"%{keyword}%"
+    if limit is None:
+        return search_pages(pattern, after_id, page_rows)
+    return iter(query_db(SQL["search_page"], (pattern, pattern, after_id, limit)))
+
+def search_pages(pattern, after_id, page_rows):
+    """Yield matching rows one keyset page (bookID > last) at a time. Each
+    page is a complete query, so a slow consumer of a stream never keeps
+    a DB connection checked out between pages."""
+    while True:
+        rows = query_db(SQL["search_page"], (pattern, pattern, after_id, page_rows))
+        yield from rows
+        if len(rows) < page_rows:
+            return
+        after_id = rows[-1][0]
+
+
+# ---------- RPCs ----------
+@rpc("get_book", Arg("book_id", integer), sql=("book_by_id",), coalesce=True)
+def get_book(book_id):
+    rows = snapshot.find([book_id])
+    if rows is None:
+        rows = fetch(SQL["book_by_id"], (book_id,))
+    return {"result": rows[0]} if rows else {"error": f"Book {book_id} not found"}
+
+@rpc("get_books", Arg("book_ids", id_list), sql=("books_by_ids",), coalesce=True)
+def get_books(book_ids):
+    # One IN (...) query for the whole batch; results follow the request
+    # order, with null for each id that does not exist
+    unique_ids = list(dict.fromkeys(book_ids))
+    rows = snapshot.find(unique_ids) if unique_ids else []
+    if rows is None:
+        rows = books_by_ids(unique_ids)
+    by_id = {row[0]: row for row in rows}
+    return {"result": [by_id.get(book_id) for book_id in book_ids],
+            "not_found": [book_id for book_id in unique_ids if book_id not in by_id]}
+
+@rpc("multi", Arg("calls", call_list))
+def multi(calls):
+    # Several calls in one frame: [{"function": ..., "args": [...]}, ...]
+    results = []
+    for call in calls:
+        if not isinstance(call, dict):
+            results.append({"error": "each call must be an object", "code": "bad_request"})
+        elif call.get("function") == "multi":
+            results.append({"error": "multi calls cannot be nested"})
+        else:
+            try:
+                results.append(handle_request({"function": call.get("function"), "args": call.get("args", [])}))
+            except Exception as e:
+                results.append({"error": str(e)})
+    return {"result": results}
+
+def stream_search(encoding, keyword, options):
+    options = options or paging_options({})
+    # One SQL page per chunk, so each chunk costs at most one query
+    rows = search_rows(keyword, options["after_id"], page_rows=options["chunk_size"])
+    yield from paging.stream_frames(rows, options["chunk_size"], encoding)
+
+@rpc("search_books", Arg("keyword", search_keyword), Arg("page", paging_options, default=None),
+     sql=("search", "search_page"), stream=stream_search, coalesce=True)
+def search_books(keyword, page):
+    if page is not None:
+        # Paged form: [keyword, {"page_size": n, "cursor": c}]
+        page_size = page["page_size"]
+        return paging.paginate(search_rows(keyword, page["after_id"], limit=page_size + 1), page_size)
+    rows = search_index.search(keyword)
+    if rows is None:
+        pattern = f"%{keyword}%"
+        rows = fetch(SQL["search"], (pattern, pattern))
+    return {"result": rows}
+
+@rpc("list_books", sql=("first_books",), coalesce=True)
+def list_books():
+    rows = snapshot.first(20)
+    if rows is None:
+        rows = fetch(SQL["first_books"])
+    return {"result": rows}
+
+@rpc("stats")
+def stats():
+    result = {"db": db.stats(), "response_cache": cache.stats(), "search_index": search_index.stats(),
+              "snapshot": snapshot.stats(), "compression": compression.stats(),
+              "metrics": metrics.stats(), "profiler": profiler.stats(), "coalescing": flights.stats()}
+    for section, source in STATS_SOURCES.items():
+        result[section] = source()
+    return {"result": result}
+
+def rebuild():
+    """Reload the snapshot and search index and drop cached searches, in this process."""
+    snapshot.load()  # pick up a rewritten snapshot file, if one is configured
+    index = search_index.build_index(query_db)
+    cache.invalidate("search_books")
+    return index
+
+@rpc("rebuild_index")
+def rebuild_index():
+    return {"result": rebuild().stats()}
+
+@rpc("invalidate_cache", Arg("function", text, default=None), Arg("args", anything, default=None))
+def invalidate_cache(function, args):
+    # args: [] for everything, [function] or [function, args] to narrow it
+    return {"result": {"invalidated": cache.invalidate(function, args)}}
+
+@rpc("profile", Arg("options", mapping, default=None))
+def profile(options):
+    # args: [] or [{"mode": "sample" | "trace", "seconds": s, "interval_ms": ms}]
+    try:
+        return {"result": profiler.start(**(options or {}))}
+    except (TypeError, ValueError, RuntimeError) as e:
+        return {"error": str(e)}
+
+@rpc("rpcs")
+def rpcs():
+    """The registered RPCs with their argument names and SQL statements."""
+    return {"result": {name: handler.describe() for name, handler in sorted(HANDLERS.items())}}
+
+
+# ---------- Dispatch ----------
+def bind(data):
+    """(RPC, argument values) for a decoded request; ArgumentError if it is malformed."""
+    if not isinstance(data, dict):
+        raise ArgumentError("A request must be an object with function and args")
+    func_name = data.get("function")
+    handler = HANDLERS.get(func_name)
+    if handler is None:
+        raise ArgumentError(f"Unknown function {func_name}")
+    return handler, handler.bind(data.get("args", []))
+
+def handle_request(data):
+    """Validate and run one decoded (non-streamed) request."""
+    try:
+        handler, args = bind(data)
+    except ArgumentError as e:
+        return {"error": str(e), "code": "bad_request"}
+    token = _coalescing.set(handler.name if handler.coalesce else None)
+    try:
+        return handler.func(*args)
+    finally:
+        _coalescing.reset(token)
+
+def stream_response(data, encoding):
+    """Yield a streamed response as chunk frames plus an end-of-stream frame"""
+    func_name = data.get("function")
+    try:
+        handler, args = bind(data)
+        if handler.stream is None:
+            raise ArgumentError(f"Streaming not supported for {func_name}")
+    except ArgumentError as e:
+        yield codec.frame({"error": str(e), "code": "bad_request", "end": True}, encoding)
+        return
+    yield from handler.stream(encoding, *args)
+
+def build_response(request: bytes, encoding: int = codec.ENC_JSON, timer=None):
+    """Return the response frames for one request: a single (possibly cached)
+    frame, or a generator of chunk frames for streamed requests. Responses
+    use the same encoding as the request. Stage times go to `timer`, a
+    metrics.Request, which also carries the request's deadline (see
+    deadlines.py; the servers check it again before sending).
+
+    A malformed envelope is answered, never raised, before anything else
+    looks at it:
+
+    >>> build_response(b'[1]')[0][codec.HEADER.size:]
+    b'{"error": "A request must be an object with function and args", "code": "bad_request"}'
+    >>> build_response(b'{"function": [1]}')[0][codec.HEADER.size:]
+    b'{"error": "Unknown function [1]", "code": "bad_request"}'
+    """
+    timer = timer or metrics.Request()
+    timer.lap("queue")
+    data = codec.decode(request, encoding)
+    if not isinstance(data, dict):
+        timer.error = True
+        return (codec.frame({"error": "A request must be an object with function and args",
+                             "code": "bad_request"}, encoding),)
+    func_name = data.get("function")
+    if not isinstance(func_name, str):
+        timer.error = True
+        response = {"error": f"Unknown function {func_name}", "code": "bad_request"}
+        if data.get("stream"):
+            response["end"] = True
+        return (codec.frame(response, encoding),)
+    timer.function = func_name
+    timer.lap("decode")
+    rejected = deadlines.admit(timer, data)
+    if rejected is not None:
+        timer.error = True
+        if data.get("stream"):
+            rejected["end"] = True
+        return (codec.frame(rejected, encoding),)
+    if data.get("stream"):
+        return stream_response(data, encoding)
+    key = request_key(data, encoding)
+    frame = cache.get(key)
+    if frame is not None:
+        timer.cached = True
+        timer.lap("cache")
+    else:
+        response = deadlines.check(timer, "db") or profiler.call(timer.function, handle_request, data)
+        timer.lap("db")
+        frame = codec.frame(response, encoding)
+        timer.lap("encode")
+        timer.error = "error" in response
+        if not timer.error:
+            cache.put(key, frame)
+    return (frame,)
@@ -0,0 +1,108 @@
+"""Fixed-size latency histogram with HdrHistogram-style log-linear buckets.
+
+Values are recorded as integer microseconds. Every power-of-two range is
+split into SUB_BUCKETS equal buckets, so any percentile is reported within
+about 1% of the true value while memory stays a few KiB no matter how many
+samples are recorded. Histograms recorded by different threads or processes
+are combined with merge(), or shipped as JSON via to_dict()/from_dict().
+"""
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS  # buckets per power of two, ~0.8% resolution
+_HALF = SUB_BUCKETS // 2
+
+
+def _index(value: int) -> int:
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * _HALF + (value >> shift)
+
+def _highest(index: int) -> int:
+    """Largest value that falls in bucket `index`."""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // _HALF - 1
+    return ((index - shift * _HALF + 1) << shift) - 1
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value_us):
+        # Called on every request by the servers' metrics, so no builtin calls beyond int()
+        value = int(value_us)
+        if value < 0:
+            value = 0
+        if value < SUB_BUCKETS:
+            index = value
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS
+            index = shift * _HALF + (value >> shift)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def record_seconds(self, seconds):
+        self.record(seconds * 1e6)
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, n in enumerate(other.counts):
+            self.counts[index] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        return self
+
+    def percentile(self, p) -> int:
+        """Value (us) at or below which p percent of the samples fall."""
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * p // 100))  # ceil, at least the first sample
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(_highest(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)) -> dict:
+        """Count plus min/mean/max and the given percentiles, in milliseconds."""
+        out = {"count": self.count, "min_ms": (self.min or 0) / 1000,
+               "mean_ms": round(self.mean() / 1000, 3), "max_ms": self.max / 1000}
+        for p in percentiles:
+            out[f"p{p:g}_ms"] = self.percentile(p) / 1000
+        return out
+
+    def to_dict(self):
+        return {"counts": {i: n for i, n in enumerate(self.counts) if n}, "count": self.count,
+                "total": self.total, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        h = cls()
+        counts = {int(i): n for i, n in data["counts"].items()}
+        h.counts = [0] * (max(counts, default=-1) + 1)
+        for index, n in counts.items():
+            h.counts[index] = n
+        h.count, h.total, h.min, h.max = data["count"], data["total"], data["min"], data["max"]
+        return h
@@ -0,0 +1,337 @@
+"""Per-process request metrics for the book servers.
+
+Every request carries a `Request` timer from the moment its header arrives
+until its last response byte is sent. The timer takes a lap at each stage:
+
+    read     rest of the frame after the header (payload, request id)
+    queue    waiting for a worker: requests on connections queued for a
+             pool thread (connection.Dispatcher), pipelined requests and
+             the asyncio server's DB executor queue up here
+    decode   JSON/MessagePack decoding of the request
+    cache    response cache lookup (cache hits only)
+    db       handle_request: the SQL query, or the index/snapshot lookup
+             that replaces it
+    encode   serializing the response into a frame
+    send     writing the frame(s) to the socket. For streamed responses
+             this includes producing the later chunks.
+
+When the request finishes, its total latency and each stage go into
+per-function histograms (histogram.py, a few KiB each). The same step
+counts calls, error responses, cache hits and bytes in/out. RPCs that
+coalesce identical queries (see singleflight.py) also count the queries
+they ran and the ones they shared with a query already in flight. Requests
+dropped for a passed deadline or shed from the queue (see deadlines.py) are
+counted by reason. Recording
+costs a handful of perf_counter() calls and one short lock per request, so
+it is on by default. Set BOOKDB_METRICS=0 to turn it off.
+
+Everything is exposed through the `stats` RPC under `metrics`. If
+BOOKDB_METRICS_PORT is set, it is also served as Prometheus text on
+http://<host>:<port>/metrics. Counters are per process. Pre-forked
+server_mp workers each serve their own endpoint on port + worker number.
+Process-per-connection children instead ship their counts to the parent
+(Registry.drain and Registry.merge), which serves the totals.
+"""
+import os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from histogram import Histogram
+
+METRICS_ENABLED = os.environ.get("BOOKDB_METRICS", "1") != "0"
+METRICS_PORT = int(os.environ.get("BOOKDB_METRICS_PORT", "0"))  # 0: no HTTP endpoint
+STAGES = ("read", "queue", "decode", "cache", "db", "encode", "send")
+MAX_FUNCTIONS = 64  # function names come from clients; the rest are counted as "other"
+
+
+class Request:
+    """Stage timer for one request; see the module docstring for the stages."""
+    __slots__ = ("function", "stages", "bytes_in", "error", "cached", "deadline", "_start", "_last")
+
+    def __init__(self):
+        self.function = None  # set once the request is decoded
+        self.stages = {}
+        self.bytes_in = 0
+        self.error = False
+        self.cached = False
+        self.deadline = None  # perf_counter() time the client stops waiting, if it set one
+        self._start = self._last = None
+
+    def begin(self, at=None):
+        """Start the clock when the request header has arrived, or at `at`
+        (a perf_counter() time) for a request that was already waiting before
+        it could be read. A running clock is left alone."""
+        if self._start is None:
+            self._start = self._last = time.perf_counter() if at is None else at
+
+    def received(self, nbytes):
+        """The whole request frame is in."""
+        self.lap("read")
+        self.bytes_in = nbytes
+
+    def lap(self, stage):
+        """Charge the time since the previous lap to `stage`."""
+        now = time.perf_counter()
+        if self._last is None:
+            self._start = now
+        else:
+            self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def expire_after(self, seconds):
+        """Set the deadline `seconds` after the request header arrived."""
+        self.deadline = (self._start if self._start is not None else time.perf_counter()) + seconds
+
+    def finish(self, bytes_out=0, error=False):
+        """Record the request once its response has been sent (or has failed)."""
+        if not METRICS_ENABLED or self.function is None:
+            return
+        self.lap("send")
+        registry.record(self, bytes_out, error or self.error)
+        self.function = None  # never recorded twice
+
+
+class FunctionStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = Histogram()
+        self.stages = {stage: Histogram() for stage in STAGES}
+
+    def to_dict(self):
+        return {"calls": self.calls, "errors": self.errors, "cache_hits": self.cache_hits,
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                "latency": self.latency.summary(),
+                "stages": {stage: h.summary() for stage, h in self.stages.items() if h.count}}
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.cache_hits += other.cache_hits
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.latency.merge(other.latency)
+        for stage, h in other.stages.items():
+            self.stages[stage].merge(h)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.functions = {}
+        self.connections_open = 0
+        self.connections_total = 0
+        self.connection_errors = {}  # exception name -> count
+        self.flights = {}  # RPC -> [queries run, queries coalesced], for RPCs that coalesce
+        self.dropped = {}  # (function, reason) -> requests dropped unanswered
+
+    def record(self, request, bytes_out, error):
+        elapsed = request._last - request._start
+        name = str(request.function)
+        with self._lock:
+            stats = self.functions.get(name)
+            if stats is None:
+                name = name if len(self.functions) < MAX_FUNCTIONS else "other"
+                stats = self.functions.setdefault(name, FunctionStats())
+            stats.calls += 1
+            stats.errors += error
+            stats.cache_hits += request.cached
+            stats.bytes_in += request.bytes_in
+            stats.bytes_out += bytes_out
+            stats.latency.record_seconds(elapsed)
+            for stage, seconds in request.stages.items():
+                stats.stages[stage].record_seconds(seconds)
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_open += 1
+            self.connections_total += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_error(self, exc):
+        """A connection ended with an exception other than a disconnect or idle timeout."""
+        name = type(exc).__name__
+        with self._lock:
+            self.connection_errors[name] = self.connection_errors.get(name, 0) + 1
+
+    def query_flight(self, function, shared):
+        """A coalescing RPC ran a query (shared=False) or joined an identical one in flight."""
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            counts = self.flights.get(function)
+            if counts is None:
+                counts = self.flights[function] = [0, 0]
+            counts[shared] += 1
+
+    def request_dropped(self, function, reason):
+        """A request was not run (or not sent) because its deadline passed or it was shed."""
+        function = str(function)
+        with self._lock:
+            if function not in self.functions and len(self.functions) >= MAX_FUNCTIONS:
+                function = "other"
+            key = (function, reason)
+            self.dropped[key] = self.dropped.get(key, 0) + 1
+
+    def drain(self) -> dict:
+        """Take everything recorded since the last drain, as a picklable dict
+        for merge(), and start counting from zero."""
+        with self._lock:
+            state = {"functions": self.functions, "connections_open": self.connections_open,
+                     "connections_total": self.connections_total, "connection_errors": self.connection_errors,
+                     "flights": self.flights, "dropped": self.dropped}
+            self.functions, self.connection_errors, self.flights, self.dropped = {}, {}, {}, {}
+            self.connections_open = self.connections_total = 0
+        return state
+
+    def merge(self, state):
+        """Add counts taken from another registry by drain()."""
+        with self._lock:
+            for name, other in state["functions"].items():
+                stats = self.functions.get(name)
+                if stats is None:
+                    name = name if len(self.functions) < MAX_FUNCTIONS else "other"
+                    stats = self.functions.setdefault(name, FunctionStats())
+                stats.merge(other)
+            self.connections_open += state["connections_open"]  # opened minus closed
+            self.connections_total += state["connections_total"]
+            for name, n in state["connection_errors"].items():
+                self.connection_errors[name] = self.connection_errors.get(name, 0) + n
+            for function, (run, shared) in state["flights"].items():
+                counts = self.flights.setdefault(function, [0, 0])
+                counts[0] += run
+                counts[1] += shared
+            for key, n in state["dropped"].items():
+                self.dropped[key] = self.dropped.get(key, 0) + n
+
+    def stats(self):
+        with self._lock:
+            functions = {name: stats.to_dict() for name, stats in self.functions.items()}
+            dropped = {}
+            for (function, reason), n in self.dropped.items():
+                dropped.setdefault(function, {})[reason] = n
+            coalescing = {name: {"queries": run, "coalesced": shared} for name, (run, shared) in self.flights.items()}
+            return {
+                "enabled": METRICS_ENABLED, "pid": os.getpid(),
+                "uptime_s": round(time.time() - self.started, 1),
+                "connections": {"open": self.connections_open, "total": self.connections_total},
+                "connection_errors": dict(self.connection_errors),
+                "bytes_in": sum(f["bytes_in"] for f in functions.values()),
+                "bytes_out": sum(f["bytes_out"] for f in functions.values()),
+                "functions": functions,
+                "coalescing": coalescing,
+                "dropped": dropped,
+            }
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP bookdb_{name} {help_text}")
+            lines.append(f"# TYPE bookdb_{name} {kind}")
+
+        def sample(name, labels, value):
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"bookdb_{name}{{{label_text}}} {value}" if label_text else f"bookdb_{name} {value}")
+
+        def metric(name, kind, help_text, samples):
+            header(name, kind, help_text)
+            for labels, value in samples:
+                sample(name, labels, value)
+
+        def summary(name, help_text, histograms):
+            header(name, "summary", help_text)
+            for labels, h in histograms:
+                for q in (0.5, 0.9, 0.99, 0.999):
+                    sample(name, {**labels, "quantile": q}, h.percentile(q * 100) / 1e6)
+                sample(name + "_sum", labels, h.total / 1e6)
+                sample(name + "_count", labels, h.count)
+
+        with self._lock:
+            functions = sorted(self.functions.items())
+            flights = sorted(self.flights.items())
+            dropped = sorted(self.dropped.items())
+            metric("connections_open", "gauge", "Client connections currently open.",
+                   [({}, self.connections_open)])
+            metric("connections_total", "counter", "Client connections accepted.",
+                   [({}, self.connections_total)])
+            metric("connection_errors_total", "counter", "Connections ended by an unexpected exception.",
+                   [({"exception": name}, n) for name, n in sorted(self.connection_errors.items())])
+            metric("requests_total", "counter", "Requests answered, by RPC function.",
+                   [({"function": f}, s.calls) for f, s in functions])
+            metric("request_errors_total", "counter", "Requests answered with an error.",
+                   [({"function": f}, s.errors) for f, s in functions])
+            metric("cache_hits_total", "counter", "Requests answered from the response cache.",
+                   [({"function": f}, s.cache_hits) for f, s in functions])
+            metric("received_bytes_total", "counter", "Request bytes read, including frame headers.",
+                   [({"function": f}, s.bytes_in) for f, s in functions])
+            metric("sent_bytes_total", "counter", "Response bytes written, including frame headers.",
+                   [({"function": f}, s.bytes_out) for f, s in functions])
+            metric("queries_total", "counter", "DB queries run by RPCs that coalesce identical queries.",
+                   [({"function": f}, run) for f, (run, _) in flights])
+            metric("coalesced_queries_total", "counter", "DB queries answered by an identical query already in flight.",
+                   [({"function": f}, shared) for f, (_, shared) in flights])
+            metric("dropped_requests_total", "counter", "Requests dropped for a passed deadline or shed from the queue.",
+                   [({"function": f, "reason": reason}, n) for (f, reason), n in dropped])
+            summary("request_seconds", "Request latency from header to last byte sent.",
+                    [({"function": f}, s.latency) for f, s in functions])
+            summary("stage_seconds", "Time spent in each stage of a request.",
+                    [({"function": f, "stage": stage}, h)
+                     for f, s in functions for stage, h in s.stages.items() if h.count])
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+
+def reset():
+    """Start over with empty counters (in a freshly forked worker), and
+    return the registry inherited from the parent."""
+    global registry
+    inherited, registry = registry, Registry()
+    inherited._lock = threading.Lock()  # another thread may have held it at the fork
+    return inherited
+
+def stats():
+    return registry.stats()
+
+
+# ---------- Prometheus endpoint ----------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would drown the server log
+
+
+def serve_http(port=METRICS_PORT, host="0.0.0.0"):
+    """Serve /metrics on a daemon thread (nothing to do when port is 0)."""
+    if not port or not METRICS_ENABLED:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"[Metrics] Could not serve metrics on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[Metrics] Prometheus metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,74 @@
+"""Cursor pagination and chunked streaming for large result sets.
+
+Paged requests pass an options object after the normal args:
+
+    {"function": "search_books", "args": ["the", {"page_size": 50, "cursor": null}]}
+    -> {"result": [...50 rows...], "next_cursor": "eyJhZnRlciI6IDEyM30="}
+
+The cursor is opaque to clients; it records the last bookID sent so the
+next page is a keyset query (`bookID > last`) and never rescans skipped rows.
+`next_cursor` is null on the last page.
+
+Streamed requests set `"stream": true` in the envelope. The server then
+answers with a series of ordinary length-prefixed frames:
+
+    {"chunk": [...rows...]}      repeated, at most `chunk_size` rows each
+    {"end": true, "count": N}    end-of-stream marker
+
+An error part-way through is sent as {"error": "...", "end": true}. Old
+servers ignore "stream" and reply with a single {"result": ...} frame, which
+clients should treat as the whole stream.
+
+`page_size` and `chunk_size` are optional, and must be integers from 1 to
+MAX_PAGE_SIZE / MAX_CHUNK_ROWS. Anything else, or a cursor this server did
+not issue, is answered with code "bad_request" (handlers.paging_options).
+"""
+import json, base64
+from itertools import islice
+import codec
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_ROWS = 200
+MAX_CHUNK_ROWS = 1000
+
+def encode_cursor(last_id) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode()).decode()
+
+def decode_cursor(cursor) -> int:
+    """bookID to resume after; 0 (start) for an empty cursor."""
+    if not cursor:
+        return 0
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["after"])
+    except Exception:
+        raise ValueError("Invalid cursor") from None
+
+def paginate(rows, page_size: int) -> dict:
+    """One page from `rows` (at most page_size + 1 are read, to see if more follow)."""
+    page = list(islice(rows, page_size + 1))
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_cursor(page[-1][0])
+    return {"result": page, "next_cursor": next_cursor}
+
+def stream_frames(rows, chunk_rows: int = STREAM_CHUNK_ROWS, encoding: int = codec.ENC_JSON):
+    """Yield `rows` as chunk frames followed by the end-of-stream frame.
+
+    Only one chunk is ever encoded at a time, so memory stays flat however
+    many rows match.
+    """
+    count = 0
+    rows = iter(rows)
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                break
+            count += len(chunk)
+            yield codec.frame({"chunk": chunk}, encoding)
+    except Exception as e:
+        yield codec.frame({"error": str(e), "end": True}, encoding)
+        return
+    yield codec.frame({"end": True, "count": count}, encoding)
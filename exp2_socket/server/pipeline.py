@@ -0,0 +1,72 @@
+"""Concurrent handling of pipelined, id-tagged requests on one connection.
+
+A connection loop keeps reading frames while tagged requests (see
+codec.FLAG_REQUEST_ID) run on a small per-connection thread pool, so a
+client can have many requests in flight on one socket. Responses go out as
+soon as they are ready, in any order, each tagged with its request id.
+Untagged requests are still answered inline, in order, exactly as before.
+"""
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+import codec, framing, deadlines
+
+# Max tagged requests in flight per connection; the reader stops reading
+# new frames (TCP backpressure) until one of them finishes.
+PIPELINE_DEPTH = int(os.environ.get("BOOKDB_PIPELINE_DEPTH", "8"))
+
+
+class Pipeline:
+    def __init__(self, conn, respond, depth=PIPELINE_DEPTH):
+        self.conn = conn
+        self.respond = respond  # (request bytes, encoding, metrics.Request) -> iterable of frames
+        self.depth = depth
+        self.compression = codec.COMP_NONE  # set once the client's hello has been answered
+        self._send_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(depth)
+        self._executor = None  # started on the first tagged request
+
+    def send(self, frames, request_id=None) -> int:
+        """Send all frames of one response; frames of other responses may interleave between them.
+        Returns the bytes written."""
+        sent = 0
+        for frame in frames:
+            with self._send_lock:
+                sent += framing.send_frame(self.conn, frame, request_id, self.compression)
+        return sent
+
+    def answer(self, request: bytes, encoding: int, timer, request_id=None):
+        """Build and send the response to one request, and record its metrics."""
+        frames = deadlines.guard(self.respond(request, encoding, timer), encoding, timer)
+        timer.finish(self.send(frames, request_id))
+
+    def submit(self, request: bytes, encoding: int, request_id: int, timer):
+        """Run a tagged request in the background (blocks while `depth` are in flight)."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.depth, thread_name_prefix="pipeline")
+        self._slots.acquire()
+        self._executor.submit(self._run, request, encoding, request_id, timer)
+
+    def _run(self, request, encoding, request_id, timer):
+        try:
+            self.answer_tagged(request, encoding, request_id, timer)
+        finally:
+            self._slots.release()
+
+    def answer_tagged(self, request: bytes, encoding: int, request_id: int, timer):
+        """Answer one tagged request on the calling thread; errors go to that request only."""
+        try:
+            self.answer(request, encoding, timer, request_id)
+        except OSError:
+            pass  # connection is gone; the reader loop will notice
+        except Exception as e:
+            # One failed request must not take down the others sharing the socket
+            try:
+                timer.finish(self.send([codec.frame({"error": str(e), "end": True}, codec.ENC_JSON)], request_id),
+                             error=True)
+            except OSError:
+                pass
+
+    def close(self):
+        """Wait for in-flight requests before the connection is closed."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
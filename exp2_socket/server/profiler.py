@@ -0,0 +1,237 @@
+"""On-demand profiling of a running book server.
+
+A profile runs for a fixed window and is started either with the `profile`
+RPC or by sending the process SIGUSR1 (which uses the defaults below).
+There are two modes:
+
+* sample (default): a background thread snapshots every thread's stack
+  each BOOKDB_PROFILE_INTERVAL_MS. Stacks inside build_response or
+  stream_response are counted under the RPC being served; threads that are
+  waiting for a request are skipped. Each handler gets a collapsed-stack
+  file (`<handler>.collapsed`, one `frame;frame;... count` line per stack)
+  for flamegraph.pl or speedscope. `all.collapsed` holds every handler
+  under one root. The cost is one stack walk per thread per interval, and
+  nothing at all while no profile is running.
+* trace: every handle_request call runs under cProfile. Each handler gets a
+  `<handler>.pstats` file (for snakeviz or `python -m pstats`) and a
+  `<handler>.txt` summary. This mode is exact but slows the profiled calls
+  down several times, so keep the window short on a loaded server. (On
+  Python 3.12+, where cProfile hooks the whole interpreter, calls that
+  overlap one already being traced run untraced.)
+
+Output goes to BOOKDB_PROFILE_DIR/<time>-<pid>/. server_mp's supervisor
+passes SIGUSR1 on to its workers, so `kill -USR1 <supervisor pid>` profiles
+every worker, each into its own directory.
+"""
+import os, sys, time, signal, threading, cProfile, pstats, re
+from collections import Counter
+
+PROFILE_DIR = os.environ.get("BOOKDB_PROFILE_DIR", "profiles")
+PROFILE_SECONDS = float(os.environ.get("BOOKDB_PROFILE_SECONDS", "10"))
+PROFILE_INTERVAL_MS = float(os.environ.get("BOOKDB_PROFILE_INTERVAL_MS", "10"))
+MAX_SECONDS = 300
+MAX_HANDLERS = 64  # handler names come from clients; the rest are filed under "other"
+MODES = ("sample", "trace")
+
+def _build_response_rpc(f_locals):
+    data = f_locals.get("data")
+    return data.get("function") if isinstance(data, dict) else "(decode)"
+
+def _stream_response_rpc(f_locals):
+    return f_locals.get("func_name")
+
+# Frames that mark a thread as serving a request, and how to name the RPC from their locals
+ENTRY_POINTS = {"build_response": _build_response_rpc, "stream_response": _stream_response_rpc}
+
+
+def _label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _safe_name(handler):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(handler))[:64] or "_"
+
+
+class Session:
+    """One profiling window; results are written when it ends."""
+
+    def __init__(self, mode, seconds, interval_ms):
+        self.mode = mode
+        self.seconds = seconds
+        self.interval = interval_ms / 1000
+        self.started = time.time()
+        self.until = self.started + seconds
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        self.dir = os.path.abspath(os.path.join(PROFILE_DIR, f"{stamp}-{os.getpid()}"))
+        self.samples = {}   # handler -> Counter of collapsed stacks
+        self.profiles = {}  # (handler, thread id) -> cProfile.Profile
+        self.calls = Counter()
+        self.handlers = set()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stop = threading.Event()
+
+    def _handler(self, handler):
+        if handler not in self.handlers:
+            if len(self.handlers) >= MAX_HANDLERS:
+                return "other"
+            self.handlers.add(handler)
+        return handler
+
+    # ---------- Sampling ----------
+    def sample_once(self, me):
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack, handler, depth = [], None, 0
+            while frame is not None:
+                stack.append(frame.f_code)
+                name_of = ENTRY_POINTS.get(frame.f_code.co_name)
+                if name_of is not None:
+                    # Walking leaf to root, so the outermost entry point wins
+                    handler, depth = name_of(frame.f_locals), len(stack)
+                frame = frame.f_back
+            if handler is None:
+                continue  # not serving a request
+            handler = self._handler(handler)
+            # Leave out the frames above the entry point (accept and read loops)
+            stack = ";".join(_label(code) for code in reversed(stack[:depth]))
+            self.samples.setdefault(handler, Counter())[stack] += 1
+
+    def run_sampler(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval) and time.time() < self.until:
+            self.sample_once(me)
+        self.finish()
+
+    # ---------- Tracing ----------
+    def trace(self, handler, func, args):
+        with self._lock:
+            handler = self._handler(handler)
+            key = (handler, threading.get_ident())
+            profile = self.profiles.get(key)
+            if profile is None:
+                profile = self.profiles[key] = cProfile.Profile()
+            self.calls[handler] += 1
+            self._in_flight += 1
+        try:
+            try:
+                profile.enable()
+            except ValueError:
+                return func(*args)  # Python 3.12+: another thread holds the profiler hook
+            try:
+                return func(*args)
+            finally:
+                profile.disable()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def run_timer(self):
+        self._stop.wait(self.seconds)
+        self.finish()
+
+    # ---------- Output ----------
+    def finish(self):
+        global _session, _last
+        with _start_lock:
+            if _session is self:
+                _session = None
+        deadline = time.time() + 5
+        while self._in_flight and time.time() < deadline:
+            time.sleep(0.01)  # let traced calls that are still running complete
+        os.makedirs(self.dir, exist_ok=True)
+        if self.mode == "sample":
+            totals = Counter()
+            for handler, stacks in self.samples.items():
+                with open(os.path.join(self.dir, f"{_safe_name(handler)}.collapsed"), "w") as f:
+                    for stack, n in stacks.most_common():
+                        f.write(f"{stack} {n}\n")
+                totals[handler] = sum(stacks.values())
+            with open(os.path.join(self.dir, "all.collapsed"), "w") as f:
+                for handler, stacks in self.samples.items():
+                    for stack, n in stacks.most_common():
+                        f.write(f"{handler};{stack} {n}\n")
+        else:
+            totals = dict(self.calls)
+            by_handler = {}
+            for (handler, _), profile in self.profiles.items():
+                by_handler.setdefault(handler, []).append(profile)
+            for handler, profiles in by_handler.items():
+                base = os.path.join(self.dir, _safe_name(handler))
+                stats = pstats.Stats(*profiles)
+                stats.dump_stats(base + ".pstats")
+                with open(base + ".txt", "w") as f:
+                    pstats.Stats(base + ".pstats", stream=f).sort_stats("cumulative").print_stats(40)
+        _last = {"mode": self.mode, "dir": self.dir, "seconds": self.seconds,
+                 ("samples" if self.mode == "sample" else "calls"): dict(totals)}
+        print(f"[Profiler] {self.mode} profile written to {self.dir}")
+
+    def info(self):
+        return {"mode": self.mode, "dir": self.dir, "seconds": self.seconds, "until": self.until}
+
+
+# ---------- Per-process profiler ----------
+_session = None
+_last = None
+_start_lock = threading.Lock()
+
+def start(mode="sample", seconds=PROFILE_SECONDS, interval_ms=PROFILE_INTERVAL_MS):
+    """Start a profiling window; ValueError for bad options, RuntimeError if one is running."""
+    global _session
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    seconds, interval_ms = float(seconds), float(interval_ms)
+    if not 0 < seconds <= MAX_SECONDS:
+        raise ValueError(f"seconds must be between 0 and {MAX_SECONDS}")
+    if interval_ms < 1:
+        raise ValueError("interval_ms must be at least 1")
+    with _start_lock:
+        if _session is not None:
+            raise RuntimeError(f"A profile is already running until {time.ctime(_session.until)}")
+        session = _session = Session(mode, seconds, interval_ms)
+    target = session.run_sampler if mode == "sample" else session.run_timer
+    threading.Thread(target=target, name="profiler", daemon=True).start()
+    print(f"[Profiler] {mode} profile for {seconds:g}s, writing to {session.dir}")
+    return session.info()
+
+def stop():
+    """End the running window early (its results are still written)."""
+    session = _session
+    if session is not None:
+        session._stop.set()
+    return session is not None
+
+def call(handler, func, *args):
+    """func(*args), under cProfile when a trace window is open."""
+    session = _session
+    if session is None or session.mode != "trace":
+        return func(*args)
+    return session.trace(handler, func, args)
+
+def stats():
+    session = _session
+    return {"running": session.info() if session is not None else None, "last": _last}
+
+
+def install_signal(children=None):
+    """Start a sampling profile on SIGUSR1. If `children` is given (a callable
+    returning pids), the installing process passes the signal on to them
+    instead. Forked children that inherit the handler profile themselves."""
+    if not hasattr(signal, "SIGUSR1"):
+        return  # e.g. Windows: use the profile RPC
+    owner = os.getpid()
+
+    def handler(signum, frame):
+        if children is not None and os.getpid() == owner:
+            for pid in children():
+                try:
+                    os.kill(pid, signum)
+                except OSError:
+                    pass
+            return
+        try:
+            start()
+        except RuntimeError as e:
+            print(f"[Profiler] {e}")
+
+    signal.signal(signal.SIGUSR1, handler)
@@ -0,0 +1,116 @@
+"""In-process cache of fully encoded RPC responses.
+
+Hot requests such as `list_books` or a popular `get_book` id are answered
+with the exact bytes that were sent last time (8-byte header included), so a
+hit skips both the database and `json.dumps`.
+
+Entries are evicted least-recently-used once the cache holds more than
+BOOKDB_CACHE_BYTES of frames, and expire after BOOKDB_CACHE_TTL seconds so
+edits to the books table show up without a restart. Set BOOKDB_CACHE_BYTES=0
+to turn the cache off. Each server process has its own cache.
+"""
+import os, json, threading, time
+from collections import OrderedDict
+
+CACHE_MAX_BYTES = int(os.environ.get("BOOKDB_CACHE_BYTES", str(32 * 1024 * 1024)))
+CACHE_TTL = float(os.environ.get("BOOKDB_CACHE_TTL", "30"))
+
+# Read-only RPCs whose answer depends only on the function and its args
+CACHEABLE = {"get_book", "get_books", "search_books", "list_books"}
+
+def request_key(data: dict, encoding: int = 0):
+    """Cache key for a decoded request, or None if it must not be cached.
+
+    The wire encoding is part of the key because the cached value is the
+    encoded frame itself.
+    """
+    func_name = data.get("function")
+    if not isinstance(func_name, str) or func_name not in CACHEABLE or data.get("stream"):
+        return None
+    try:
+        args_key = json.dumps(data.get("args"), separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None  # e.g. MessagePack bin args: answered uncached (the RPC rejects them)
+    return (func_name, args_key, encoding)
+
+
+class ResponseCache:
+    """Thread-safe LRU of response frames bounded by total size in bytes."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (frame, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def get(self, key):
+        if key is None or self.max_bytes <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counts["misses"] += 1
+                return None
+            frame, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._drop(key)
+                self._counts["expired"] += 1
+                self._counts["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counts["hits"] += 1
+            return frame
+
+    def put(self, key, frame: bytes):
+        if key is None or len(frame) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (frame, time.monotonic() + self.ttl)
+            self._bytes += len(frame)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._counts["evictions"] += 1
+
+    def _drop(self, key):
+        frame, _ = self._entries.pop(key)
+        self._bytes -= len(frame)
+
+    def invalidate(self, function=None, args=None):
+        """Drop cached responses.
+
+        With no arguments everything goes; `function` limits it to one RPC and
+        `function` plus `args` to a single request. Returns the number dropped.
+        """
+        with self._lock:
+            if function is None:
+                keys = list(self._entries)
+            elif args is not None:
+                try:
+                    args_key = json.dumps(args, separators=(",", ":"))
+                except (TypeError, ValueError):
+                    args_key = None  # request_key never caches such args
+                keys = [k for k in self._entries if k[0] == function and k[1] == args_key]
+            else:
+                keys = [k for k in self._entries if k[0] == function]
+            for key in keys:
+                self._drop(key)
+            self._counts["invalidations"] += len(keys)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._counts)
+            s["entries"] = len(self._entries)
+            s["bytes"] = self._bytes
+        s["max_bytes"] = self.max_bytes
+        lookups = s["hits"] + s["misses"]
+        s["hit_ratio"] = s["hits"] / lookups if lookups else 0.0
+        return s
+
+
+cache = ResponseCache()
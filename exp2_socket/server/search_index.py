@@ -0,0 +1,158 @@
+"""In-memory trigram index for `search_books`.
+
+`search_books` used to run `title LIKE '%kw%' OR authors LIKE '%kw%'`, which
+MySQL can only answer with a full table scan. Instead the app tier loads the
+books table once and indexes every 3-character substring of title and authors.
+Each trigram maps to a sorted `array('I')` of row numbers. A search
+intersects the postings of the keyword's trigrams and then checks only those
+candidate rows with a real substring test.
+
+Text is folded the way the database's LIKE compares it, so results match
+the SQL query, in bookID order: MySQL's default utf8mb4 collation ignores
+case and accents, SQLite's LIKE only the case of ASCII letters.
+Keywords containing the LIKE wildcards `%` or `_` are left to the database,
+and on MySQL so are those containing `\\`, LIKE's default escape character
+(SQLite's LIKE has no escape character unless the query names one).
+
+Call `build_index()` at startup and again (or the `rebuild_index` RPC)
+after the books table changes. With a catalog snapshot mapped (see
+snapshot.py) the rows are read from it instead of through SQL.
+Set BOOKDB_SEARCH_INDEX=0 to always use SQL.
+"""
+import os, string, threading, time, unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+import db, snapshot
+
+SEARCH_INDEX_ENABLED = os.environ.get("BOOKDB_SEARCH_INDEX", "1") != "0"
+SEPARATOR = "\x00"  # between title and authors so no match can span both
+
+def fold_accents(text) -> str:
+    """Case- and accent-insensitive form of a string, like MySQL's *_ai_ci collations"""
+    if text is None:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def fold_ascii(text) -> str:
+    """Form of a string in which only ASCII letters ignore case, like SQLite's LIKE"""
+    return "" if text is None else str(text).translate(_ASCII_LOWER)
+
+FOLDS = {"mysql": fold_accents, "sqlite": fold_ascii}  # BOOKDB_BACKEND -> its LIKE comparison
+fold = FOLDS.get(db.BACKEND, fold_accents)
+# Characters that LIKE doesn't match literally; keywords with any of them go to SQL
+LIKE_SPECIAL = "%_" if fold is fold_ascii else "%_\\"
+
+def _sql_only(keyword) -> bool:
+    return not isinstance(keyword, str) or any(c in keyword for c in LIKE_SPECIAL)
+
+def trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Trigram -> row-number postings over the title and authors columns."""
+
+    def __init__(self, rows):
+        # A mapped snapshot is kept as is (rows are decoded when a search returns them)
+        self.rows = rows if isinstance(rows, snapshot.Snapshot) else list(rows)
+        self._ids = array("q", (row[0] for row in self.rows))  # sorted bookIDs, for cursors
+        self._haystacks = []
+        postings = {}
+        for row_no, row in enumerate(self.rows):
+            haystack = fold(row[1]) + SEPARATOR + fold(row[2])
+            self._haystacks.append(haystack)
+            for gram in trigrams(haystack):
+                postings.setdefault(gram, []).append(row_no)
+        # Row numbers are appended in order, so every posting list is sorted
+        self._postings = {gram: array("I", nums) for gram, nums in postings.items()}
+
+    def _is_candidate(self, row_no, others):
+        for posting in others:
+            i = bisect_left(posting, row_no)
+            if i == len(posting) or posting[i] != row_no:
+                return False
+        return True
+
+    def iter_search(self, keyword: str, after_id=0):
+        """Yield rows whose title or authors contain keyword, in bookID order,
+        starting after bookID `after_id`."""
+        needle = fold(keyword)
+        grams = trigrams(needle)
+        start = bisect_right(self._ids, after_id) if after_id else 0
+        if not grams:
+            # Too short to have a trigram: a plain scan of the folded text is still cheap
+            candidates = range(start, len(self._haystacks))
+        else:
+            postings = []
+            for gram in grams:
+                posting = self._postings.get(gram)
+                if posting is None:
+                    return
+                postings.append(posting)
+            postings.sort(key=len)
+            rarest, others = postings[0], postings[1:]
+            candidates = (n for n in rarest[bisect_left(rarest, start):] if self._is_candidate(n, others))
+        for n in candidates:
+            if needle in self._haystacks[n]:
+                yield self.rows[n]
+
+    def search(self, keyword: str):
+        """Rows whose title or authors contain keyword, in table order."""
+        return list(self.iter_search(keyword))
+
+    def stats(self):
+        return {
+            "rows": len(self.rows),
+            "trigrams": len(self._postings),
+            "postings": sum(len(p) for p in self._postings.values()),
+        }
+
+
+# ---------- Per-process index ----------
+_index = None
+_built_at = None
+_build_lock = threading.Lock()
+
+def build_index(query_db):
+    """(Re)load the books table and swap in a fresh index. Rows come from the
+    mapped snapshot if there is one, otherwise through `query_db`."""
+    global _index, _built_at
+    with _build_lock:
+        start = time.perf_counter()
+        rows = snapshot.current()
+        index = TrigramIndex(rows if rows is not None else query_db("SELECT * FROM books ORDER BY bookID"))
+        _index, _built_at = index, time.time()
+    print(f"[Search Index] Indexed {len(index.rows)} books in {time.perf_counter() - start:.2f}s")
+    return index
+
+def warm(query_db):
+    """Build the index at server startup; on failure searches fall back to SQL."""
+    if not SEARCH_INDEX_ENABLED:
+        return
+    try:
+        build_index(query_db)
+    except Exception as e:
+        print(f"[Search Index] Build failed, using SQL LIKE for searches: {e}")
+
+def search(keyword):
+    """Index answer for a search, or None when the caller must run the SQL query."""
+    index = _index
+    if index is None or _sql_only(keyword):
+        return None
+    return index.search(keyword)
+
+def iter_search(keyword, after_id=0):
+    """Like search(), but lazily and resuming after a bookID (for paging)."""
+    index = _index
+    if index is None or _sql_only(keyword):
+        return None
+    return index.iter_search(keyword, after_id)
+
+def stats():
+    index = _index
+    if index is None:
+        return {"enabled": SEARCH_INDEX_ENABLED, "built": False}
+    return {"enabled": SEARCH_INDEX_ENABLED, "built": True, "built_at": _built_at, **index.stats()}
@@ -1,58 +1,8 @@
 import socket
-import json
-import struct
 import sys
-import mysql.connector
-
-def recv_exact(sock, n: int) -> bytes:
-    """Receive exactly n bytes from the socket."""
-    data = b""
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            raise ConnectionError("Connection closed")
-        data += packet
-    return data
-
-def query_db(query, params=()):
-    """Run a query against the MySQL database and return results."""
-    conn = mysql.connector.connect(
-        host="127.0.0.1",      # <-- Change this to PC1's IP when DB is remote
-        user="bookuser",       # must match the user you created in MySQL
-        password="password123",# must match the password you set
-        database="bookdb"      # name of the DB created in MySQL
-    )
-    cur = conn.cursor()
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def handle_request(request: str):
-    """Handle incoming client requests and query DB accordingly."""
-    data = json.loads(request)
-    func_name = data["function"]
-    args = data["args"]
-
-    if func_name == "get_book":
-        book_id = args[0]
-        rows = query_db("SELECT * FROM books WHERE bookID=%s", (book_id,))
-        if rows:
-            return {"result": rows[0]}
-        else:
-            return {"error": f"Book with ID {book_id} not found"}
-
-    elif func_name == "search_books":
-        keyword = f"%{args[0]}%"
-        rows = query_db("SELECT * FROM books WHERE title LIKE %s OR authors LIKE %s", (keyword, keyword))
-        return {"result": rows}
-
-    elif func_name == "list_books":
-        rows = query_db("SELECT * FROM books LIMIT 20")
-        return {"result": rows}
-
-    else:
-        return {"error": f"Unknown function {func_name}"}
+from db import query_db
+from handlers import build_response
+import search_index, snapshot, codec, framing, compression, metrics, profiler, deadlines
 
 def main():
     if len(sys.argv) != 2:
@@ -61,6 +11,10 @@ def main():
 
     host = "0.0.0.0"  # listen on all interfaces (LAN + localhost)
     port = int(sys.argv[1])
+    snapshot.load()
+    search_index.warm(query_db)
+    metrics.serve_http()
+    profiler.install_signal()
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -71,29 +25,39 @@ def main():
         while True:
             conn, addr = s.accept()
             print(f"[Server] Client connected from {addr}")
+            metrics.registry.connection_opened()
             with conn:
+                framing.configure(conn)
+                method = codec.COMP_NONE  # until the client's hello negotiates one
                 while True:
+                    timer = metrics.Request()
                     try:
-                        size_data = recv_exact(conn, 8)
-                        if not size_data:
-                            break
-                        (size,) = struct.unpack("Q", size_data)
-                        request = recv_exact(conn, size).decode()
-
-                        response = handle_request(request)
-                        response_bytes = json.dumps(response).encode()
-
-                        conn.sendall(struct.pack("Q", len(response_bytes)))
-                        conn.sendall(response_bytes)
-
-                    except ConnectionError:
+                        request, flags, request_id = framing.recv_frame(conn, timer)
+                        hello = compression.handshake(request, codec.encoding_of(flags))
+                        if hello is not None:
+                            reply, method = hello
+                            timer.function = "hello"
+                            timer.finish(framing.send_frame(conn, codec.frame(reply, codec.encoding_of(flags)), request_id))
+                            continue
+                        # Pipelined (tagged) requests are answered in arrival order here;
+                        # the threaded and multiprocess servers run them concurrently
+                        sent = 0
+                        frames = build_response(request, codec.encoding_of(flags), timer)
+                        for frame in deadlines.guard(frames, codec.encoding_of(flags), timer):
+                            sent += framing.send_frame(conn, frame, request_id, method)
+                        timer.finish(sent)
+
+                    except (ConnectionError, TimeoutError):
                         print(f"[Server] Client {addr} disconnected")
                         break
                     except Exception as e:
-                        error = json.dumps({"error": str(e)}).encode()
-                        conn.sendall(struct.pack("Q", len(error)))
-                        conn.sendall(error)
+                        metrics.registry.connection_error(e)
+                        try:
+                            timer.finish(framing.send_frame(conn, codec.frame({"error": str(e)})), error=True)
+                        except OSError:
+                            pass
                         break
+            metrics.registry.connection_closed()
 
 if __name__ == "__main__":
     main()
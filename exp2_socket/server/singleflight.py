@@ -0,0 +1,70 @@
+"""Single-flight execution of identical concurrent calls.
+
+When a title trends, many connections ask for the same rows at the same
+moment. Without coordination each of them runs the same query on its own
+pooled connection. With a SingleFlight the first caller for a key runs the
+call. Callers that arrive with the same key while it is running wait for it
+and share its result, or its exception.
+
+Nothing is kept once the call returns: the next caller runs it again. A
+shared result is therefore never older than a query that was already in
+progress when the caller asked, so this cuts load during bursts without
+serving stale data the way a cache can. Waiters get the very same object as
+the caller that ran the query, so results must be treated as read-only.
+"""
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; see the module docstring."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call in progress
+        self._stats = {"executed": 0, "coalesced": 0, "max_waiters": 0}
+
+    def do(self, key, func, *args):
+        """Return (func(*args), shared). `shared` is True when the result came
+        from an identical call that another thread was already running."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["executed"] += 1
+            else:
+                call.waiters += 1
+                self._stats["coalesced"] += 1
+                self._stats["max_waiters"] = max(self._stats["max_waiters"], call.waiters)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["in_flight"] = len(self._calls)
+        return s
@@ -0,0 +1,211 @@
+"""Read-only, memory-mapped snapshot of the books table.
+
+`database/db_setup.py --snapshot` writes the table to one compact binary
+file. A server started with BOOKDB_SNAPSHOT=<path> maps that file instead of
+loading the table through SQL. get_book, get_books and list_books are then
+answered from it, and the search index is built from it. Mapping a file is
+instant whatever its size, and pages are only read as rows are touched.
+server_mp maps it before forking, so every worker shares the same physical
+pages through the OS page cache instead of holding its own copy.
+
+File layout (native byte order, every section 8-byte aligned):
+
+    header     magic, version, row count, section count
+    sections   (offset, length) of each section below
+    bookID     int64 per row, ascending: the bookID -> row index (binary search)
+    numbers    int64 (NULL = INT64_MIN) or float64 (NULL = NaN) per row
+    strings    uint32 start offset per row plus one end offset, into the heap,
+               and one byte per row that is 1 for NULL
+    heap       all string values, UTF-8, back to back
+
+The file is written to a temporary name and renamed into place, so servers
+that still map the previous snapshot keep reading a complete file.
+"""
+import os, sys, mmap, math, struct, threading, time
+from array import array
+from bisect import bisect_left
+
+MAGIC = b"BOOKSNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sIII")  # magic, version, rows, sections
+SECTION = struct.Struct("<QQ")    # offset, length
+INT_NULL = -(1 << 63)
+
+# Column order and storage type, matching SELECT * FROM books
+COLUMNS = [("bookID", "id"), ("title", "str"), ("authors", "str"), ("average_rating", "float"),
+           ("isbn", "str"), ("isbn13", "str"), ("language_code", "str"), ("num_pages", "int"),
+           ("ratings_count", "int"), ("text_reviews_count", "int"), ("publication_date", "str"),
+           ("publisher", "str")]
+
+SNAPSHOT_PATH = os.environ.get("BOOKDB_SNAPSHOT")  # unset: serve everything through SQL
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+def write(rows, path):
+    """Write rows (SELECT * FROM books ORDER BY bookID) as a snapshot file."""
+    rows = sorted(rows, key=lambda row: row[0])
+    n = len(rows)
+    heap = bytearray()
+    sections = [array("q", (row[0] for row in rows)).tobytes()]
+    for col, (name, kind) in enumerate(COLUMNS):
+        if kind == "int":
+            sections.append(array("q", (INT_NULL if row[col] is None else int(row[col]) for row in rows)).tobytes())
+        elif kind == "float":
+            sections.append(array("d", (math.nan if row[col] is None else float(row[col]) for row in rows)).tobytes())
+        elif kind == "str":
+            offsets, nulls = array("I"), bytearray(n)
+            for i, row in enumerate(rows):
+                offsets.append(len(heap))
+                if row[col] is None:
+                    nulls[i] = 1
+                else:
+                    heap += str(row[col]).encode("utf-8")
+            offsets.append(len(heap))
+            if len(heap) > 0xFFFFFFFF:
+                raise ValueError("String heap exceeds 4 GiB")
+            sections += [offsets.tobytes(), bytes(nulls)]
+    sections.append(bytes(heap))
+
+    table_end = HEADER.size + SECTION.size * len(sections)
+    offset, layout = _align(table_end), []
+    for data in sections:
+        layout.append((offset, len(data)))
+        offset = _align(offset + len(data))
+
+    tmp_path = path + ".writing"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n, len(sections)))
+        for entry in layout:
+            f.write(SECTION.pack(*entry))
+        for (start, _), data in zip(layout, sections):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, path)
+    return layout[-1][0] + layout[-1][1]  # file size
+
+
+class Snapshot:
+    """Sequence of book rows (tuples, as from SQL) backed by a mapped file."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        if sys.byteorder != "little":
+            raise ValueError("Snapshots are only supported on little-endian machines")
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, version, self._n, count = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} book snapshot")
+        sections = [view[start:start + length]
+                    for start, length in (SECTION.unpack_from(view, HEADER.size + i * SECTION.size)
+                                          for i in range(count))]
+        self._ids = sections[0].cast("q")
+        self._heap = sections[-1]
+        # One reader per column: (kind, data[, nulls])
+        self._columns, pos = [], 1
+        for name, kind in COLUMNS:
+            if kind == "id":
+                self._columns.append(("id", self._ids))
+            elif kind == "int":
+                self._columns.append(("int", sections[pos].cast("q")))
+                pos += 1
+            elif kind == "float":
+                self._columns.append(("float", sections[pos].cast("d")))
+                pos += 1
+            else:
+                self._columns.append(("str", sections[pos].cast("I"), sections[pos + 1]))
+                pos += 2
+        self.size = len(self._mmap)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        row = []
+        for column in self._columns:
+            kind, data = column[0], column[1]
+            if kind == "str":
+                row.append(None if column[2][i] else str(self._heap[data[i]:data[i + 1]], "utf-8"))
+            elif kind == "float":
+                value = data[i]
+                row.append(None if value != value else value)  # NaN marks NULL
+            elif kind == "int":
+                value = data[i]
+                row.append(None if value == INT_NULL else value)
+            else:
+                row.append(data[i])
+        return tuple(row)
+
+    def __iter__(self):
+        return (self[i] for i in range(self._n))
+
+    def row_number(self, book_id):
+        """Row number of a bookID, or None if it is not in the snapshot."""
+        i = bisect_left(self._ids, book_id)
+        return i if i < self._n and self._ids[i] == book_id else None
+
+    def get(self, book_id):
+        i = self.row_number(book_id)
+        return None if i is None else self[i]
+
+
+# ---------- Per-process snapshot ----------
+_current = None
+_loaded_at = None
+_lock = threading.Lock()
+
+def load(path=SNAPSHOT_PATH):
+    """Map the snapshot at startup (no-op when BOOKDB_SNAPSHOT is unset).
+    On failure the server keeps answering through SQL."""
+    global _current, _loaded_at
+    if not path:
+        return None
+    try:
+        start = time.perf_counter()
+        snap = Snapshot(path)
+    except (OSError, ValueError) as e:
+        print(f"[Snapshot] Could not map {path}, using SQL: {e}")
+        return None
+    with _lock:
+        _current, _loaded_at = snap, time.time()
+    print(f"[Snapshot] Mapped {len(snap)} books from {snap.path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return snap
+
+def current():
+    return _current
+
+def find(book_ids):
+    """Rows for the given bookIDs (missing ones left out), or None without a snapshot."""
+    snap = _current
+    if snap is None:
+        return None
+    rows = []
+    for book_id in book_ids:
+        try:
+            row = snap.get(int(book_id))
+        except (TypeError, ValueError):
+            continue
+        if row is not None:
+            rows.append(row)
+    return rows
+
+def first(n):
+    """The first n rows in bookID order, or None without a snapshot."""
+    snap = _current
+    if snap is None:
+        return None
+    return [snap[i] for i in range(min(n, len(snap)))]
+
+def stats():
+    snap = _current
+    if snap is None:
+        return {"enabled": bool(SNAPSHOT_PATH), "loaded": False}
+    return {"enabled": True, "loaded": True, "path": snap.path, "rows": len(snap),
+            "bytes": snap.size, "loaded_at": _loaded_at}
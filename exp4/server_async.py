@@ -0,0 +1,154 @@
+import asyncio, sys, os
+from concurrent.futures import ThreadPoolExecutor
+
+# Same request handling (and response cache) as the other servers, so the variants can be
+# benchmarked against each other on identical RPC semantics
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exp2_socket", "server"))
+from db import query_db
+from handlers import build_response
+import db, search_index, snapshot, codec, framing, compression, metrics, profiler, deadlines
+from pipeline import PIPELINE_DEPTH
+
+# Blocking MySQL calls run on a small executor sized to the DB pool, so a
+# worker never waits on a connection. At most MAX_PENDING requests may be
+# queued for it at once; further connections just wait in their own coroutine.
+DB_WORKERS = int(os.environ.get("BOOKDB_ASYNC_WORKERS", str(db.POOL_SIZE)))
+MAX_PENDING = DB_WORKERS * 4
+
+executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+pending = None  # asyncio.Semaphore, created once the loop is running
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the bounded DB executor."""
+    async with pending:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, *args)
+
+async def write_frame(writer, frame, request_id, method) -> int:
+    """Queue one frame on the writer; returns its size on the wire."""
+    if method and len(frame) - codec.HEADER.size >= compression.COMPRESS_THRESHOLD:
+        # Compressing a big frame takes milliseconds; keep it off the loop
+        frame = await run_blocking(compression.compress_frame, frame, method)
+    else:
+        frame = compression.compress_frame(frame, method)
+    parts = codec.tag_parts(frame, request_id)
+    writer.writelines(parts)
+    return sum(len(p) for p in parts)
+
+async def send_response(writer, request, encoding, timer, request_id=None, method=codec.COMP_NONE):
+    frames = deadlines.guard(await run_blocking(build_response, request, encoding, timer), encoding, timer)
+    sent = 0
+    if isinstance(frames, tuple):
+        for frame in frames:
+            sent += await write_frame(writer, frame, request_id, method)
+        await writer.drain()
+    else:
+        # Streamed response: pull each chunk off the executor so
+        # slow DB reads never block the loop
+        while (frame := await run_blocking(next, frames, None)) is not None:
+            sent += await write_frame(writer, frame, request_id, method)
+            await writer.drain()
+    timer.finish(sent)
+
+async def send_tagged(writer, request, encoding, timer, request_id, slots, method):
+    """Answer one pipelined request; errors are reported to that request only"""
+    try:
+        await send_response(writer, request, encoding, timer, request_id, method)
+    except ConnectionError:
+        pass
+    except Exception as e:
+        timer.finish(await write_frame(writer, codec.frame({"error": str(e), "end": True}), request_id, codec.COMP_NONE),
+                     error=True)
+    finally:
+        slots.release()
+
+async def client_handler(reader, writer):
+    """Coroutine serving one client connection on the shared event loop"""
+    addr = writer.get_extra_info("peername")
+    print(f"[Server] Client connected: {addr}")
+    metrics.registry.connection_opened()
+    slots = asyncio.Semaphore(PIPELINE_DEPTH)
+    tasks = set()
+    method = codec.COMP_NONE  # until the client's hello negotiates one
+    try:
+        while True:
+            timer = metrics.Request()
+            try:
+                # Same limits as the blocking servers (see framing.py); asyncio
+                # already sets TCP_NODELAY on its sockets
+                size_data = await asyncio.wait_for(reader.readexactly(8), framing.IDLE_TIMEOUT)
+                timer.begin()
+                size, flags = codec.unpack_header(size_data)
+                framing.check_size(size)
+                request_id = None
+                if flags & codec.FLAG_REQUEST_ID:
+                    (request_id,) = codec.REQUEST_ID.unpack(await reader.readexactly(codec.REQUEST_ID.size))
+                request = await asyncio.wait_for(reader.readexactly(size), framing.FRAME_TIMEOUT)
+                timer.received(codec.HEADER.size + (request_id is not None) * codec.REQUEST_ID.size + size)
+                hello = compression.handshake(request, codec.encoding_of(flags))
+                if hello is not None:
+                    reply, method = hello
+                    timer.function = "hello"
+                    sent = await write_frame(writer, codec.frame(reply, codec.encoding_of(flags)), request_id, codec.COMP_NONE)
+                    await writer.drain()
+                    timer.finish(sent)
+                elif request_id is None:
+                    await send_response(writer, request, codec.encoding_of(flags), timer, method=method)
+                else:
+                    # Tagged requests run concurrently and may be answered out of order
+                    await slots.acquire()
+                    task = asyncio.create_task(
+                        send_tagged(writer, request, codec.encoding_of(flags), timer, request_id, slots, method))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+                break
+            except Exception as e:
+                metrics.registry.connection_error(e)
+                try:
+                    frame = codec.frame({"error": str(e)})
+                    writer.write(frame)
+                    await writer.drain()
+                    timer.finish(len(frame), error=True)
+                except Exception:
+                    pass
+                break
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        metrics.registry.connection_closed()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+    print(f"[Server] Client disconnected: {addr}")
+
+async def serve(host, port):
+    global pending
+    pending = asyncio.Semaphore(MAX_PENDING)
+    server = await asyncio.start_server(client_handler, host, port, reuse_address=True, backlog=1024)
+    print(f"[Async Server] Listening on {host}:{port} ({DB_WORKERS} DB workers)...")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python server_async.py <port>")
+        sys.exit(1)
+
+    host = "0.0.0.0"
+    port = int(sys.argv[1])
+    snapshot.load()
+    search_index.warm(query_db)
+    metrics.serve_http()
+    profiler.install_signal()
+    try:
+        asyncio.run(serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=False)
+
+if __name__ == "__main__":
+    main()
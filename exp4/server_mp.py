@@ -1,95 +1,240 @@
-import socket, json, struct, sys, multiprocessing
-import mysql.connector
-
-# ---------- Helpers ----------
-def recv_exact(sock, n: int) -> bytes:
-    data = b""
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            raise ConnectionError("Connection closed")
-        data += packet
-    return data
-
-def query_db(query, params=()):
-    conn = mysql.connector.connect(
-        host="127.0.0.1",   # change to PC1 IP if DB is remote
-        user="bookuser",
-        password="password123",
-        database="bookdb"
-    )
-    cur = conn.cursor()
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def handle_request(request: str):
-    data = json.loads(request)
-    func_name = data["function"]
-    args = data["args"]
-
-    if func_name == "get_book":
-        book_id = args[0]
-        rows = query_db("SELECT * FROM books WHERE bookID=%s", (book_id,))
-        return {"result": rows[0]} if rows else {"error": f"Book {book_id} not found"}
-
-    elif func_name == "search_books":
-        keyword = f"%{args[0]}%"
-        rows = query_db("SELECT * FROM books WHERE title LIKE %s OR authors LIKE %s", (keyword, keyword))
-        return {"result": rows}
-
-    elif func_name == "list_books":
-        rows = query_db("SELECT * FROM books LIMIT 20")
-        return {"result": rows}
+import socket, sys, os, time, argparse, signal, threading, multiprocessing
+import multiprocessing.connection
 
-    else:
-        return {"error": f"Unknown function {func_name}"}
+# Shared DB layer lives next to the original single-threaded server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exp2_socket", "server"))
+from db import query_db
+from handlers import rpc, Arg, mapping, text, anything
+from response_cache import cache
+import db, handlers, search_index, snapshot, metrics, profiler, connection
 
-def client_process(conn, addr):
-    print(f"[Server] Client connected: {addr}")
-    with conn:
-        while True:
+@rpc("profile", Arg("options", mapping, default=None))
+def profile(options):
+    """The shared profile RPC, plus {"all_workers": true}: signal the
+    supervisor, which starts a default profile in every worker."""
+    options = dict(options or {})
+    if options.pop("all_workers", False):
+        os.kill(os.getppid(), signal.SIGUSR1)
+        return {"result": {"signalled": os.getppid()}}
+    return handlers.profile(options)
+
+# ---------- Broadcast admin RPCs ----------
+# Every process has its own search index and response cache, so an admin RPC
+# signals the supervisor instead of acting where it happens to be served.
+# The supervisor acts too, so processes it forks later inherit the result.
+BROADCASTS = {}  # signal -> action run in the supervisor and every child
+
+def install_broadcasts(children):
+    """Handle BROADCASTS in this process (the supervisor) and, once they
+    have forked, in its children. `children` returns their pids."""
+    owner = os.getpid()
+
+    def run(action):
+        try:
+            action()
+        except Exception as e:
+            print(f"[Multiprocessing Server] {action.__name__} failed in pid {os.getpid()}: {e}")
+
+    def handler(signum, frame):
+        action = BROADCASTS[signum]
+        if os.getpid() != owner:
+            # Off the signal-interrupted thread, which may be serving a client
+            threading.Thread(target=run, args=(action,), daemon=True).start()
+            return
+        for pid in children():
             try:
-                size_data = recv_exact(conn, 8)
-                if not size_data:
-                    break
-                (size,) = struct.unpack("Q", size_data)
-                request = recv_exact(conn, size).decode()
-                response = handle_request(request)
-                response_bytes = json.dumps(response).encode()
-                conn.sendall(struct.pack("Q", len(response_bytes)))
-                conn.sendall(response_bytes)
-            except Exception as e:
-                error = json.dumps({"error": str(e)}).encode()
-                try:
-                    conn.sendall(struct.pack("Q", len(error)))
-                    conn.sendall(error)
-                except:
-                    pass
-                break
-    print(f"[Server] Client disconnected: {addr}")
+                os.kill(pid, signum)
+            except OSError:
+                pass
+        run(action)  # inline: the supervisor forks, so it must not leave threads behind
+        db.close()
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python server_books_multiprocess.py <port>")
-        sys.exit(1)
+    for signum in BROADCASTS:
+        signal.signal(signum, handler)
 
-    host = "0.0.0.0"
-    port = int(sys.argv[1])
+def clear_cache():
+    cache.invalidate()
+
+BROADCASTS[signal.SIGHUP] = handlers.rebuild
+BROADCASTS[signal.SIGUSR2] = clear_cache
+
+@rpc("rebuild_index")
+def rebuild_index():
+    """Signal the supervisor, which rebuilds the search index in itself and every worker."""
+    os.kill(os.getppid(), signal.SIGHUP)
+    return {"result": {"signalled": os.getppid()}}
+
+@rpc("invalidate_cache", Arg("function", text, default=None), Arg("args", anything, default=None))
+def invalidate_cache(function, args):
+    """The shared RPC in this process, then SIGUSR2 to the supervisor. A
+    signal can't carry the narrowing args, so every process drops its whole
+    cache; "invalidated" counts this process's entries only."""
+    result = handlers.invalidate_cache(function, args)["result"]
+    os.kill(os.getppid(), signal.SIGUSR2)
+    return {"result": {**result, "pid": os.getpid(), "signalled": os.getppid()}}
+
+# ---------- Pre-fork mode ----------
+RESTART_BACKOFF = 1.0  # seconds to wait before respawning a worker that died right away
+
+def make_listener(host, port, reuseport=False):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        # Every worker binds its own socket; the kernel spreads connections across them
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((host, port))
+    s.listen(128)
+    return s
+
+def worker_main(worker_id, listener, host, port, threads, queue_size):
+    """Long-lived worker: accept and serve connections until killed.
+
+    `listener` is the parent's shared socket, or None to bind a private
+    SO_REUSEPORT socket. Connections are multiplexed over the worker's
+    `threads` threads by a connection.Dispatcher, so idle keep-alive
+    clients hold no thread and there is no per-worker connection limit.
+    """
+    if listener is None:
+        listener = make_listener(host, port, reuseport=True)
+    print(f"[Worker {worker_id}] pid {os.getpid()} accepting with {threads} thread(s)")
+    metrics.reset()
+    profiler.install_signal()
+    if metrics.METRICS_PORT:
+        metrics.serve_http(metrics.METRICS_PORT + worker_id)
+    dispatcher = connection.Dispatcher(threads, queue_size).start()
+    handlers.STATS_SOURCES["worker_pool"] = dispatcher.stats
+
+    while True:
+        try:
+            conn, addr = listener.accept()
+        except OSError as e:
+            print(f"[Worker {worker_id}] accept failed: {e}")
+            continue
+        dispatcher.add(conn, addr)
+
+def run_prefork(host, port, workers, threads, queue_size, reuseport):
+    """Start a fixed set of workers and respawn any that exit."""
+    listener = None if reuseport else make_listener(host, port)
+    mode = "SO_REUSEPORT" if reuseport else "shared socket"
+    print(f"[Multiprocessing Server] Pre-forking {workers} workers on {host}:{port} ({mode})...")
 
+    procs, started = {}, {}
+    profiler.install_signal(children=lambda: [p.pid for p in procs.values()])
+    install_broadcasts(children=lambda: [p.pid for p in procs.values()])
+
+    def spawn(worker_id):
+        p = multiprocessing.Process(target=worker_main, args=(worker_id, listener, host, port, threads, queue_size),
+                                    daemon=True)
+        p.start()
+        procs[worker_id], started[worker_id] = p, time.monotonic()
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    try:
+        while True:
+            multiprocessing.connection.wait([p.sentinel for p in procs.values()])
+            for worker_id, p in list(procs.items()):
+                if p.is_alive():
+                    continue
+                print(f"[Multiprocessing Server] Worker {worker_id} (pid {p.pid}) exited with {p.exitcode}, restarting")
+                if time.monotonic() - started[worker_id] < RESTART_BACKOFF:
+                    time.sleep(RESTART_BACKOFF)  # don't spin if it dies on startup
+                spawn(worker_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs.values():
+            p.terminate()
+        for p in procs.values():
+            p.join()
+        if listener is not None:
+            listener.close()
+
+# ---------- Process-per-connection mode ----------
+METRICS_FLUSH_INTERVAL = 1.0  # seconds between a client process's metrics reports to the parent
+
+def serve_client(conn, addr, reports):
+    """Client process: serve one connection, sending its metrics to the
+    parent through `reports` every METRICS_FLUSH_INTERVAL and at the end."""
+    # The stats RPC answers with the totals inherited at the fork plus this
+    # process's own counts; the parent's /metrics endpoint has everyone's
+    totals = metrics.reset()
+    done = threading.Event()
+
+    def flush():
+        counts = metrics.registry.drain()
+        totals.merge(counts)
+        reports.put(counts)
+
+    def report():
+        while not done.wait(METRICS_FLUSH_INTERVAL):
+            flush()
+
+    def current_totals():
+        flush()
+        return totals.stats()
+
+    handlers.STATS_SOURCES["metrics"] = current_totals
+    threading.Thread(target=report, name="metrics-report", daemon=True).start()
+    try:
+        connection.serve(conn, addr)
+    finally:
+        done.set()
+        flush()
+
+def collect_reports(reports):
+    while True:
+        metrics.registry.merge(reports.get())
+
+def run_per_connection(host, port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((host, port))
         s.listen()
         print(f"[Multiprocessing Server] Listening on {host}:{port}...")
+        # Client processes inherit the handler and profile themselves
+        profiler.install_signal(children=lambda: [p.pid for p in multiprocessing.active_children()])
+        install_broadcasts(children=lambda: [p.pid for p in multiprocessing.active_children()])
+        # Children report their counts here, so the totals outlive them
+        reports = multiprocessing.Queue()
+        threading.Thread(target=collect_reports, args=(reports,), name="metrics-collect", daemon=True).start()
+        metrics.serve_http()
 
         while True:
             conn, addr = s.accept()
             # Start new process per client
-            process = multiprocessing.Process(target=client_process, args=(conn, addr))
+            process = multiprocessing.Process(target=serve_client, args=(conn, addr, reports))
             process.daemon = True
             process.start()
+            conn.close()  # the child owns the connection now
+
+def main():
+    parser = argparse.ArgumentParser(description="Multiprocessing book RPC server")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--prefork", action="store_true",
+                        help="serve from a fixed pool of long-lived workers instead of a process per client")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of pre-forked workers (default: one per core)")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="threads per worker; they serve all of its connections, one request at a time (default: 4)")
+    parser.add_argument("--queue", type=int, default=64,
+                        help="requests allowed to wait for a worker's threads before their connection gets a busy "
+                             "error (default: 64)")
+    parser.add_argument("--shared-socket", action="store_true",
+                        help="accept on one inherited socket instead of per-worker SO_REUSEPORT sockets")
+    args = parser.parse_args()
+
+    host = "0.0.0.0"
+    # Built once in the parent; forked children share it copy-on-write
+    snapshot.load()
+    search_index.warm(query_db)
+    db.close()  # children open their own DB connections
+    if args.prefork:
+        reuseport = hasattr(socket, "SO_REUSEPORT") and not args.shared_socket
+        run_prefork(host, args.port, args.workers, args.threads, args.queue, reuseport)
+    else:
+        run_per_connection(host, args.port)
 
 if __name__ == "__main__":
     main()
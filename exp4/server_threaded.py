@@ -1,96 +1,50 @@
-import socket, json, struct, sys, threading
-import mysql.connector
+import socket, sys, os, argparse, threading
 
-# ---------- Helpers ----------
-def recv_exact(sock, n: int) -> bytes:
-    """Receive exactly n bytes from socket"""
-    data = b""
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            raise ConnectionError("Connection closed")
-        data += packet
-    return data
-
-def query_db(query, params=()):
-    """Run query on MySQL database"""
-    conn = mysql.connector.connect(
-        host="127.0.0.1",   # change to PC1 IP if DB is remote
-        user="bookuser",
-        password="password123",
-        database="bookdb"
-    )
-    cur = conn.cursor()
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def handle_request(request: str):
-    """Handle incoming function calls from clients"""
-    data = json.loads(request)
-    func_name = data["function"]
-    args = data["args"]
-
-    if func_name == "get_book":
-        book_id = args[0]
-        rows = query_db("SELECT * FROM books WHERE bookID=%s", (book_id,))
-        return {"result": rows[0]} if rows else {"error": f"Book {book_id} not found"}
-
-    elif func_name == "search_books":
-        keyword = f"%{args[0]}%"
-        rows = query_db("SELECT * FROM books WHERE title LIKE %s OR authors LIKE %s", (keyword, keyword))
-        return {"result": rows}
-
-    elif func_name == "list_books":
-        rows = query_db("SELECT * FROM books LIMIT 20")
-        return {"result": rows}
-
-    else:
-        return {"error": f"Unknown function {func_name}"}
-
-def client_thread(conn, addr):
-    """Thread to handle each client connection"""
-    print(f"[Server] Client connected: {addr}")
-    with conn:
-        while True:
-            try:
-                size_data = recv_exact(conn, 8)
-                if not size_data:
-                    break
-                (size,) = struct.unpack("Q", size_data)
-                request = recv_exact(conn, size).decode()
-                response = handle_request(request)
-                response_bytes = json.dumps(response).encode()
-                conn.sendall(struct.pack("Q", len(response_bytes)))
-                conn.sendall(response_bytes)
-            except Exception as e:
-                error = json.dumps({"error": str(e)}).encode()
-                try:
-                    conn.sendall(struct.pack("Q", len(error)))
-                    conn.sendall(error)
-                except:
-                    pass
-                break
-    print(f"[Server] Client disconnected: {addr}")
+# Shared DB layer lives next to the original single-threaded server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exp2_socket", "server"))
+from db import query_db
+import handlers, search_index, snapshot, metrics, profiler, connection
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python server_books_threaded.py <port>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Threaded book RPC server")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="serve every connection from a fixed pool of N threads, one request at a time "
+                             "(default: one thread per client)")
+    parser.add_argument("--queue", type=int, default=64,
+                        help="requests allowed to wait for a worker before their connection gets a busy error "
+                             "(default: 64)")
+    args = parser.parse_args()
 
     host = "0.0.0.0"
-    port = int(sys.argv[1])
+    port = args.port
+
+    snapshot.load()
+    search_index.warm(query_db)
+    metrics.serve_http()
+    profiler.install_signal()
+
+    dispatcher = None
+    if args.workers > 0:
+        # Idle keep-alive connections wait in a selector, so they never tie up a worker
+        dispatcher = connection.Dispatcher(args.workers, args.queue).start()
+        handlers.STATS_SOURCES["worker_pool"] = dispatcher.stats
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((host, port))
         s.listen()
-        print(f"[Threaded Server] Listening on {host}:{port}...")
+        if dispatcher is not None:
+            print(f"[Threaded Server] Listening on {host}:{port} ({args.workers} workers, queue {args.queue})...")
+        else:
+            print(f"[Threaded Server] Listening on {host}:{port}...")
 
         while True:
             conn, addr = s.accept()
-            thread = threading.Thread(target=client_thread, args=(conn, addr), daemon=True)
+            if dispatcher is not None:
+                dispatcher.add(conn, addr)
+                continue
+            thread = threading.Thread(target=connection.serve, args=(conn, addr), daemon=True)
             thread.start()
 
 if __name__ == "__main__":
@@ -0,0 +1,371 @@
+"""Load-test harness for the gRPC PowerService (grpc_server.py).
+
+Closed loop: --concurrency callers each keep one call in flight, spread
+round-robin over --channels channels. Each channel is its own HTTP/2
+connection, so more channels spread the calls over more server-side
+connections (and more stream quota under --max-concurrent-streams):
+
+    python grpc_bench.py --rpc unary --style aio --concurrency 64 --channels 4 --duration 10
+
+Call styles:
+
+    sync    one thread per caller, making blocking stub calls
+    future  no caller threads: one thread starts calls with .future(), and
+            each finished call's callback hands its slot back for the next
+    aio     grpc.aio channels, one asyncio task per caller
+
+--rpc picks ComputePower (unary), ComputePowerBatch (batch, --batch-size
+elements per call) or ComputePowerStream (stream). In stream mode each
+caller keeps one bidirectional stream open and sends its next message when
+the previous answer arrives. That needs the sync or aio style. Latency is
+measured per call, or per message for streams.
+
+Calls started during --warmup are not measured. --requests stops after that
+many measured calls instead of after --duration. Latencies go into
+HdrHistogram-style histograms (exp2_socket/server/histogram.py). The
+report also has QPS and p50/p99 for each --interval, and client and server
+CPU sampled every interval while the run lasts (100% = one core). The
+server is found by its listening port on this host, or pass --server-pid.
+--json writes everything, including the raw histogram, for comparing runs.
+"""
+import os, sys, time, json, queue, asyncio, argparse, threading
+from functools import partial
+import grpc
+import psutil
+import power_pb2
+import power_pb2_grpc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exp2_socket", "server"))
+from histogram import Histogram
+
+RPCS = ("unary", "batch", "stream")
+STYLES = ("sync", "future", "aio")
+X, Y = 1729.0, 11.0  # every call computes X ** Y (batch_size times for batch and stream)
+
+
+def make_messages(rpc, batch_size):
+    """The request every call sends, and the response it should get back"""
+    if rpc == "unary":
+        return power_pb2.PowerRequest(x=X, y=Y), power_pb2.PowerResponse(result=X ** Y)
+    return (power_pb2.PowerBatchRequest(x=[X] * batch_size, y=[Y]),
+            power_pb2.PowerBatchResponse(result=[X ** Y] * batch_size))
+
+
+class Recorder:
+    """Decides when calls may start, and collects latencies, errors and the
+    per-interval timeline from every caller."""
+
+    def __init__(self, warmup, duration, requests, interval):
+        self.start = time.perf_counter()
+        self.measure_from = self.start + warmup
+        self.stop_at = self.measure_from + duration if duration else float("inf")
+        self.remaining = requests  # measured calls still to start, when limited by count
+        self.interval = interval
+        self.latency = Histogram()
+        self.timeline = {}  # interval number -> Histogram of the calls that finished in it
+        self.errors = {}    # status code name -> count
+        self.last_done = self.measure_from
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Start time for a caller's next call, or None once the run is over."""
+        now = time.perf_counter()
+        if now >= self.stop_at:
+            return None
+        if now >= self.measure_from and self.remaining is not None:
+            with self._lock:
+                if self.remaining <= 0:
+                    return None
+                self.remaining -= 1
+        return now
+
+    def done(self, started, error=None):
+        now = time.perf_counter()
+        if started < self.measure_from:
+            return  # warmup
+        with self._lock:
+            self.last_done = max(self.last_done, now)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+                return
+            self.latency.record_seconds(now - started)
+            bucket = int((now - self.measure_from) / self.interval)
+            hist = self.timeline.get(bucket)
+            if hist is None:
+                hist = self.timeline[bucket] = Histogram()
+            hist.record_seconds(now - started)
+
+
+class CpuSampler:
+    """Samples client and server CPU every `interval` seconds on a background thread."""
+
+    def __init__(self, server_pid, interval, measure_from):
+        self.processes = {"client": psutil.Process()}
+        if server_pid:
+            try:
+                self.processes["server"] = psutil.Process(server_pid)
+            except psutil.Error as e:
+                print(f"[Bench] Not sampling server CPU: {e}")
+        self.interval = interval
+        self.measure_from = measure_from
+        self.samples = {name: [] for name in self.processes}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cpu-sampler", daemon=True)
+
+    def _run(self):
+        for process in self.processes.values():
+            process.cpu_percent(None)  # the first call only sets the baseline
+        last = time.perf_counter()
+        while True:
+            stopped = self._stop.wait(self.interval)
+            now = time.perf_counter()
+            for name, process in self.processes.items():
+                try:
+                    percent = process.cpu_percent(None)
+                except psutil.Error:
+                    continue  # server exited
+                if last >= self.measure_from:  # skip samples that overlap the warmup
+                    self.samples[name].append([round(now - self.measure_from, 3), percent])
+            last = now
+            if stopped:
+                return  # the last sample covers the final partial interval
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        out = {}
+        for name, samples in self.samples.items():
+            values = [percent for _, percent in samples]
+            out[name] = {"mean_percent": round(sum(values) / len(values), 1) if values else None,
+                         "max_percent": max(values, default=None), "samples": samples}
+        return out
+
+def find_server_pid(target):
+    """PID of the local process listening on target's port, if it can be seen."""
+    try:
+        port = int(target.rsplit(":", 1)[1])
+        for conn in psutil.net_connections(kind="tcp"):
+            if conn.status == psutil.CONN_LISTEN and conn.laddr and conn.laddr.port == port and conn.pid:
+                return conn.pid
+    except (ValueError, IndexError, psutil.Error):
+        pass
+    return None
+
+
+# ---------- Call styles ----------
+def unary_method(stub, rpc):
+    return stub.ComputePower if rpc == "unary" else stub.ComputePowerBatch
+
+def sync_stream(stub, request, recorder):
+    """One caller on a bidi stream; a stream that fails is replaced by a new one"""
+    while True:
+        outbox = queue.Queue()
+        responses = stub.ComputePowerStream(iter(outbox.get, None))
+        try:
+            while (started := recorder.begin()) is not None:
+                outbox.put(request)
+                if next(responses, None) is None:  # server ended the stream
+                    recorder.done(started, responses.code().name)
+                    break
+                recorder.done(started)
+            else:
+                return
+        except grpc.RpcError as e:
+            recorder.done(started, e.code().name)
+        finally:
+            outbox.put(None)
+            responses.cancel()
+
+def run_sync(target, rpc, request, concurrency, channels, recorder):
+    chans = [grpc.insecure_channel(target) for _ in range(channels)]
+    stubs = [power_pb2_grpc.PowerServiceStub(c) for c in chans]
+
+    def caller(stub):
+        if rpc == "stream":
+            return sync_stream(stub, request, recorder)
+        method = unary_method(stub, rpc)
+        while (started := recorder.begin()) is not None:
+            try:
+                method(request)
+                recorder.done(started)
+            except grpc.RpcError as e:
+                recorder.done(started, e.code().name)
+
+    threads = [threading.Thread(target=caller, args=(stubs[i % channels],), daemon=True)
+               for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for c in chans:
+        c.close()
+
+def run_future(target, rpc, request, concurrency, channels, recorder):
+    chans = [grpc.insecure_channel(target) for _ in range(channels)]
+    methods = [unary_method(power_pb2_grpc.PowerServiceStub(c), rpc) for c in chans]
+    ready = queue.Queue()  # caller slots free to start their next call
+
+    def finished(slot, started, future):
+        error = future.exception()
+        recorder.done(started, None if error is None else error.code().name)
+        ready.put(slot)
+
+    for slot in range(concurrency):
+        ready.put(slot)
+    active = concurrency
+    while active:
+        slot = ready.get()
+        started = recorder.begin()
+        if started is None:
+            active -= 1
+            continue
+        methods[slot % channels].future(request).add_done_callback(partial(finished, slot, started))
+    for c in chans:
+        c.close()
+
+async def run_aio(target, rpc, request, concurrency, channels, recorder):
+    chans = [grpc.aio.insecure_channel(target) for _ in range(channels)]
+    stubs = [power_pb2_grpc.PowerServiceStub(c) for c in chans]
+
+    async def stream_caller(stub):
+        while True:
+            call = stub.ComputePowerStream()
+            try:
+                while (started := recorder.begin()) is not None:
+                    await call.write(request)
+                    if await call.read() is grpc.aio.EOF:  # server ended the stream
+                        recorder.done(started, (await call.code()).name)
+                        break
+                    recorder.done(started)
+                else:
+                    return
+            except grpc.RpcError as e:
+                recorder.done(started, e.code().name)
+            finally:
+                call.cancel()
+
+    async def caller(stub):
+        if rpc == "stream":
+            return await stream_caller(stub)
+        method = unary_method(stub, rpc)
+        while (started := recorder.begin()) is not None:
+            try:
+                await method(request)
+                recorder.done(started)
+            except grpc.RpcError as e:
+                recorder.done(started, e.code().name)
+
+    await asyncio.gather(*(caller(stubs[i % channels]) for i in range(concurrency)))
+    for c in chans:
+        await c.close()
+
+
+def run(target="localhost:50051", rpc="unary", style="sync", concurrency=8, channels=1, duration=10.0,
+        warmup=2.0, requests=None, batch_size=1000, interval=1.0, server_pid=None):
+    """Run one load test and return its results as a dict."""
+    if rpc not in RPCS or style not in STYLES:
+        raise ValueError(f"rpc must be one of {', '.join(RPCS)} and style one of {', '.join(STYLES)}")
+    if rpc == "stream" and style == "future":
+        raise ValueError("Streams need the sync or aio style")
+    channels = max(1, min(channels, concurrency))
+    request, response = make_messages(rpc, batch_size)
+    elements = 1 if rpc == "unary" else batch_size
+    server_pid = server_pid or find_server_pid(target)
+
+    recorder = Recorder(warmup, None if requests else duration, requests, interval)
+    sampler = CpuSampler(server_pid, interval, recorder.measure_from)
+    sampler.start()
+    if style == "aio":
+        asyncio.run(run_aio(target, rpc, request, concurrency, channels, recorder))
+    elif style == "future":
+        run_future(target, rpc, request, concurrency, channels, recorder)
+    else:
+        run_sync(target, rpc, request, concurrency, channels, recorder)
+    sampler.stop()
+
+    elapsed = recorder.last_done - recorder.measure_from
+    count = recorder.latency.count
+    rows = []  # [start, seconds, histogram] per interval
+    for bucket in range(max(recorder.timeline, default=-1) + 1):
+        start = bucket * interval
+        rows.append([start, min(interval, elapsed - start), recorder.timeline.get(bucket, Histogram())])
+    if len(rows) > 1 and rows[-1][1] < interval / 2:
+        # Calls still finishing after the run ended: too few milliseconds for a
+        # QPS of their own, so they count towards the interval before
+        _, seconds, hist = rows.pop()
+        rows[-1][1] += seconds
+        rows[-1][2].merge(hist)
+    timeline = [{"t_s": round(start, 3), "requests": hist.count,
+                 "qps": round(hist.count / seconds, 1) if seconds > 0 else 0.0,
+                 "p50_ms": hist.percentile(50) / 1000, "p99_ms": hist.percentile(99) / 1000}
+                for start, seconds, hist in rows]
+    return {
+        "config": {"target": target, "rpc": rpc, "style": style, "concurrency": concurrency,
+                   "channels": channels, "duration": None if requests else duration, "requests": requests,
+                   "warmup": warmup, "batch_size": None if rpc == "unary" else batch_size,
+                   "interval": interval, "server_pid": server_pid},
+        "elapsed_s": round(elapsed, 3),
+        "requests": count,
+        "throughput_rps": round(count / elapsed, 1) if elapsed > 0 else 0.0,
+        "elements": count * elements,
+        "elements_per_s": round(count * elements / elapsed, 1) if elapsed > 0 else 0.0,
+        # Protobuf payload per call, without gRPC and HTTP/2 framing
+        "bytes_per_call": {"request": request.ByteSize(), "response": response.ByteSize()},
+        "errors": recorder.errors,
+        "latency": recorder.latency.summary(),
+        "timeline": timeline,
+        "cpu": sampler.summary(),
+        "histogram": recorder.latency.to_dict(),
+    }
+
+def print_result(result):
+    cfg, s = result["config"], result["latency"]
+    unit = "message" if cfg["rpc"] == "stream" else "call"
+    print(f"{cfg['target']}  {cfg['rpc']} RPC, {cfg['style']} style, {cfg['concurrency']} callers over "
+          f"{cfg['channels']} channel(s), {result['elapsed_s']}s measured")
+    print(f"  {result['requests']} {unit}s, {result['throughput_rps']} {unit}s/s, "
+          f"{result['elements_per_s']:,.0f} elements/s, errors: {result['errors'] or 'none'}")
+    print(f"  latency ms: p50 {s['p50_ms']:.3f}  p90 {s['p90_ms']:.3f}  p99 {s['p99_ms']:.3f}  "
+          f"p99.9 {s['p99.9_ms']:.3f}  max {s['max_ms']:.3f}")
+    print(f"  bytes per {unit}: {result['bytes_per_call']['request']} out, {result['bytes_per_call']['response']} in "
+          f"(protobuf payload only)")
+    for name, cpu in result["cpu"].items():
+        if cpu["mean_percent"] is not None:
+            print(f"  {name} CPU: mean {cpu['mean_percent']}%, max {cpu['max_percent']}%")
+    print(f"  {'t (s)':>7} {'qps':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for row in result["timeline"]:
+        print(f"  {row['t_s']:>7.1f} {row['qps']:>10.1f} {row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test harness for the gRPC PowerService")
+    parser.add_argument("--target", default="localhost:50051")
+    parser.add_argument("--rpc", choices=RPCS, default="unary")
+    parser.add_argument("--style", choices=STYLES, default="sync")
+    parser.add_argument("--concurrency", type=int, default=8, help="calls kept in flight")
+    parser.add_argument("--channels", type=int, default=1, help="channels (HTTP/2 connections) to spread them over")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds")
+    parser.add_argument("--requests", type=int, help="stop after this many measured calls instead")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of load before measuring")
+    parser.add_argument("--batch-size", type=int, default=1000, help="elements per batch call or stream message")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds per timeline row and CPU sample")
+    parser.add_argument("--server-pid", type=int, help="server process to sample CPU from (default: found by port)")
+    parser.add_argument("--json", help="write the results (with the raw histogram) to this file")
+    args = parser.parse_args()
+
+    try:
+        result = run(args.target, args.rpc, args.style, args.concurrency, args.channels, args.duration,
+                     args.warmup, args.requests, args.batch_size, args.interval, args.server_pid)
+    except ValueError as e:
+        parser.error(str(e))
+    print_result(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import power_pb2_grpc
 import time
 import psutil
 import os
+import grpc_bench
 
 def run(num_requests):
     # Connect to server
@@ -16,42 +17,97 @@ def run(num_requests):
     response = stub.ComputePower(request)
     print(f"Single call: {x} ** {y} = {response.result}")
 
-    # Performance measurement: Multiple requests
+    channel.close()
+
+    # Blocking calls one at a time, as before; grpc_bench.py has the
+    # concurrent styles. Latency percentiles replace the old mean, and CPU
+    # is sampled while the calls run rather than after them.
+    result = grpc_bench.run("localhost:50051", rpc="unary", style="sync", concurrency=1, channels=1,
+                            requests=num_requests, warmup=0.5, interval=0.5)
+    grpc_bench.print_result(result)
+    return result
+
+def batch_requests(num_elements, batch_size, x, y):
+    """PowerBatchRequests for num_elements copies of x ** y, batch_size per message"""
+    for start in range(0, num_elements, batch_size):
+        yield power_pb2.PowerBatchRequest(x=[x] * min(batch_size, num_elements - start), y=[y])
+
+def report_elements(name, num_elements, num_messages, total_time, cpu_time, request_size, response_size):
+    total_bandwidth = (request_size + response_size) / 1024  # Total KB
+    print(f"Performance of {name} for {num_elements} elements in {num_messages} messages:")
+    print(f"Total execution time: {total_time:.4f} seconds")
+    print(f"Throughput: {num_elements / total_time:,.0f} elements/s")
+    print(f"Average time per element: {total_time / num_elements * 1e6:.3f} us")
+    print(f"Average time per message: {total_time / num_messages * 1000:.4f} ms")
+    print(f"Average CPU usage: {cpu_time / total_time * 100:.2f}%")
+    print(f"Total bandwidth consumption: {total_bandwidth:.2f} KB (excl. HTTP/2 headers)")
+    print(f"Average bandwidth per element: {(request_size + response_size) / num_elements:.2f} bytes")
+    return total_time, num_elements / total_time, total_bandwidth
+
+def run_batch(num_elements, batch_size=10000):
+    """One ComputePowerBatch call per batch_size elements"""
+    channel = grpc.insecure_channel('localhost:50051')
+    stub = power_pb2_grpc.PowerServiceStub(channel)
+
+    response = stub.ComputePowerBatch(power_pb2.PowerBatchRequest(x=[2.0, 0.0, 1729.0], y=[3.0, -1.0, 11.0]))
+    print(f"Single batch call: [2, 0, 1729] ** [3, -1, 11] = {list(response.result)}")
+
+    x, y = 1729.0, 11.0
     process = psutil.Process(os.getpid())
+    cpu_start = sum(process.cpu_times()[:2])
     start_time = time.perf_counter()
-    total_request_size = 0
-    total_response_size = 0
+    total_request_size = total_response_size = num_messages = 0
     results = []
-    
-    for _ in range(num_requests):
-        request = power_pb2.PowerRequest(x=x, y=y)
-        request_size = len(request.SerializeToString())  # Bytes for request
-        total_request_size += request_size
-        
-        response = stub.ComputePower(request)
-        response_size = len(response.SerializeToString())  # Bytes for response
-        total_response_size += response_size
-        
-        results.append(response.result)  # Collect to avoid optimization skips
-
-    end_time = time.perf_counter()
-    # Measure CPU with longer interval for better accuracy
-    cpu_usage = process.cpu_percent(interval= 7.0)  # Wait 0.5s to capture usage
-
-    total_time = end_time - start_time
-    avg_latency = total_time / num_requests * 1000  # ms per request
-    total_bandwidth = (total_request_size + total_response_size) / 1024  # Total KB
-    avg_bandwidth_per_request = total_bandwidth / num_requests  # Avg KB per request
-
-    print(f"Performance for {num_requests} requests:")
-    print(f"Total execution time: {total_time:.4f} seconds")
-    print(f"Average latency per request: {avg_latency:.4f} ms")
-    print(f"Average CPU usage: {cpu_usage:.2f}%")
-    print(f"Total bandwidth consumption: {total_bandwidth:.2f} KB (excl. ~100-200 bytes/call HTTP/2 headers)")
-    print(f"Average bandwidth per request: {avg_bandwidth_per_request:.4f} KB")
-    
-    return total_time, avg_latency, cpu_usage, total_bandwidth, avg_bandwidth_per_request
+
+    for request in batch_requests(num_elements, batch_size, x, y):
+        total_request_size += request.ByteSize()
+        response = stub.ComputePowerBatch(request)
+        total_response_size += response.ByteSize()
+        results.extend(response.result)
+        num_messages += 1
+
+    total_time = time.perf_counter() - start_time
+    cpu_time = sum(process.cpu_times()[:2]) - cpu_start
+    channel.close()
+    assert len(results) == num_elements and results[-1] == x ** y
+    return report_elements("ComputePowerBatch", num_elements, num_messages, total_time, cpu_time,
+                           total_request_size, total_response_size)
+
+def run_stream(num_elements, batch_size=1000):
+    """One ComputePowerStream call, sending batch_size elements per message"""
+    channel = grpc.insecure_channel('localhost:50051')
+    stub = power_pb2_grpc.PowerServiceStub(channel)
+
+    x, y = 1729.0, 11.0
+    process = psutil.Process(os.getpid())
+    cpu_start = sum(process.cpu_times()[:2])
+    start_time = time.perf_counter()
+    sizes = {"request": 0}
+    total_response_size = num_messages = 0
+    results = []
+
+    def requests():
+        for request in batch_requests(num_elements, batch_size, x, y):
+            sizes["request"] += request.ByteSize()
+            yield request
+
+    # gRPC sends the requests from its own thread while responses are read
+    # here, so the messages are pipelined on one HTTP/2 stream
+    for response in stub.ComputePowerStream(requests()):
+        total_response_size += response.ByteSize()
+        results.extend(response.result)
+        num_messages += 1
+
+    total_time = time.perf_counter() - start_time
+    cpu_time = sum(process.cpu_times()[:2]) - cpu_start
+    channel.close()
+    assert len(results) == num_elements and results[-1] == x ** y
+    return report_elements("ComputePowerStream", num_elements, num_messages, total_time, cpu_time,
+                           sizes["request"], total_response_size)
 
 if __name__ == '__main__':
     for num in [1000]:
-        run(num_requests=num)
\ No newline at end of file
+        run(num_requests=num)
+    for num in [1000, 1000000]:
+        run_batch(num_elements=num)
+        run_stream(num_elements=num)
@@ -1,23 +1,130 @@
+import argparse
+import asyncio
 import grpc
 from concurrent import futures
+import numpy as np
 import power_pb2
 import power_pb2_grpc
 
+# ---------- Shared servicer logic ----------
+def power(x, y):
+    try:
+        return x ** y
+    except ZeroDivisionError:
+        return 0.0  # Handle cases like 0 ** negative
+
+def power_batch(x, y):
+    """x ** y for every element, in one vectorized NumPy pass. y may also hold a
+    single exponent for all of x. 0 ** negative gives 0.0, as in ComputePower.
+    A negative base with a fractional exponent gives nan."""
+    x = np.fromiter(x, dtype=np.float64, count=len(x))  # fastest copy out of a protobuf repeated field
+    y = np.fromiter(y, dtype=np.float64, count=len(y))
+    with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+        result = np.power(x, y)
+    result[(x == 0) & (y < 0)] = 0.0  # Handle cases like 0 ** negative
+    return result
+
+def batch_response(request):
+    """The PowerBatchResponse for a PowerBatchRequest; ValueError if y doesn't fit x"""
+    if len(request.y) not in (1, len(request.x)):
+        raise ValueError(f"y must have 1 or {len(request.x)} elements, got {len(request.y)}")
+    result = power_batch(request.x, request.y).tolist() if len(request.x) else []
+    return power_pb2.PowerBatchResponse(result=result)
+
 class PowerServiceServicer(power_pb2_grpc.PowerServiceServicer):
     def ComputePower(self, request, context):
+        return power_pb2.PowerResponse(result=power(request.x, request.y))
+
+    def ComputePowerBatch(self, request, context):
+        try:
+            return batch_response(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def ComputePowerStream(self, request_iterator, context):
+        for request in request_iterator:
+            try:
+                yield batch_response(request)
+            except ValueError as e:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+class AsyncPowerServiceServicer(power_pb2_grpc.PowerServiceServicer):
+    """The same RPCs for the grpc.aio server. The work is too small to be worth
+    a thread hop, so it runs on the event loop."""
+
+    async def ComputePower(self, request, context):
+        return power_pb2.PowerResponse(result=power(request.x, request.y))
+
+    async def ComputePowerBatch(self, request, context):
         try:
-            result = request.x ** request.y
-        except ZeroDivisionError:
-            result = 0.0  # Handle cases like 0 ** negative
-        return power_pb2.PowerResponse(result=result)
+            return batch_response(request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    async def ComputePowerStream(self, request_iterator, context):
+        async for request in request_iterator:
+            try:
+                yield batch_response(request)
+            except ValueError as e:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+# ---------- Servers ----------
+def server_options(max_concurrent_streams=None, keepalive_time_ms=None, keepalive_timeout_ms=None):
+    """Channel arguments shared by both server modes; None keeps gRPC's default"""
+    options = []
+    if max_concurrent_streams:
+        options.append(("grpc.max_concurrent_streams", max_concurrent_streams))  # per HTTP/2 connection
+    if keepalive_time_ms:
+        options += [
+            ("grpc.keepalive_time_ms", keepalive_time_ms),  # ping idle connections this often
+            ("grpc.keepalive_permit_without_calls", 1),
+            # Accept client pings at the same rate instead of closing the connection with GOAWAY
+            ("grpc.http2.min_ping_interval_without_data_ms", keepalive_time_ms),
+            ("grpc.http2.max_pings_without_data", 0),
+        ]
+    if keepalive_timeout_ms:
+        options.append(("grpc.keepalive_timeout_ms", keepalive_timeout_ms))  # drop if no ping ack by then
+    return options
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+def serve(port=50051, workers=4, options=(), max_concurrent_rpcs=None):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers), options=options,
+                         maximum_concurrent_rpcs=max_concurrent_rpcs)
     power_pb2_grpc.add_PowerServiceServicer_to_server(PowerServiceServicer(), server)
-    server.add_insecure_port('[::]:50051')
-    print("gRPC Server running on port 50051...")
+    server.add_insecure_port(f'[::]:{port}')
+    print(f"gRPC Server running on port {port} ({workers} worker threads)...")
     server.start()
     server.wait_for_termination()
 
+async def serve_aio(port=50051, options=(), max_concurrent_rpcs=None):
+    server = grpc.aio.server(options=options, maximum_concurrent_rpcs=max_concurrent_rpcs)
+    power_pb2_grpc.add_PowerServiceServicer_to_server(AsyncPowerServiceServicer(), server)
+    server.add_insecure_port(f'[::]:{port}')
+    print(f"gRPC Server running on port {port} (asyncio)...")
+    await server.start()
+    await server.wait_for_termination()
+
+def main():
+    parser = argparse.ArgumentParser(description="gRPC PowerService server")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--mode", choices=("thread", "aio"), default="thread",
+                        help="thread: grpc.server on a thread pool; aio: grpc.aio on one event loop (default: thread)")
+    parser.add_argument("--workers", type=int, default=4, help="thread pool size in thread mode (default: 4)")
+    parser.add_argument("--max-concurrent-rpcs", type=int, default=None,
+                        help="RPCs allowed in progress at once; more get RESOURCE_EXHAUSTED (default: no limit)")
+    parser.add_argument("--max-concurrent-streams", type=int, default=None,
+                        help="HTTP/2 streams allowed at once per client connection; gRPC refuses streams "
+                             "beyond it with UNAVAILABLE, so spread heavy load over channels (default: gRPC's)")
+    parser.add_argument("--keepalive-time-ms", type=int, default=None,
+                        help="ping idle connections this often, and accept client pings this often (default: gRPC's)")
+    parser.add_argument("--keepalive-timeout-ms", type=int, default=None,
+                        help="close a connection whose ping is not acknowledged within this time (default: gRPC's)")
+    args = parser.parse_args()
+
+    options = server_options(args.max_concurrent_streams, args.keepalive_time_ms, args.keepalive_timeout_ms)
+    if args.mode == "aio":
+        asyncio.run(serve_aio(args.port, options, args.max_concurrent_rpcs))
+    else:
+        serve(args.port, args.workers, options, args.max_concurrent_rpcs)
+
 if __name__ == '__main__':
-    serve()
\ No newline at end of file
+    main()
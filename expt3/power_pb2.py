@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0bpower.proto\"$\n\x0cPowerRequest\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\"\x1f\n\rPowerResponse\x12\x0e\n\x06result\x18\x01 \x01(\x02\x32=\n\x0cPowerService\x12-\n\x0c\x43omputePower\x12\r.PowerRequest\x1a\x0e.PowerResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0bpower.proto\"$\n\x0cPowerRequest\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\"\x1f\n\rPowerResponse\x12\x0e\n\x06result\x18\x01 \x01(\x02\")\n\x11PowerBatchRequest\x12\t\n\x01x\x18\x01 \x03(\x01\x12\t\n\x01y\x18\x02 \x03(\x01\"$\n\x12PowerBatchResponse\x12\x0e\n\x06result\x18\x01 \x03(\x01\x32\xbe\x01\n\x0cPowerService\x12-\n\x0c\x43omputePower\x12\r.PowerRequest\x1a\x0e.PowerResponse\x12<\n\x11\x43omputePowerBatch\x12\x12.PowerBatchRequest\x1a\x13.PowerBatchResponse\x12\x41\n\x12\x43omputePowerStream\x12\x12.PowerBatchRequest\x1a\x13.PowerBatchResponse(\x01\x30\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -35,6 +35,10 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_POWERREQUEST']._serialized_end=51
   _globals['_POWERRESPONSE']._serialized_start=53
   _globals['_POWERRESPONSE']._serialized_end=84
-  _globals['_POWERSERVICE']._serialized_start=86
-  _globals['_POWERSERVICE']._serialized_end=147
+  _globals['_POWERBATCHREQUEST']._serialized_start=86
+  _globals['_POWERBATCHREQUEST']._serialized_end=127
+  _globals['_POWERBATCHRESPONSE']._serialized_start=129
+  _globals['_POWERBATCHRESPONSE']._serialized_end=165
+  _globals['_POWERSERVICE']._serialized_start=168
+  _globals['_POWERSERVICE']._serialized_end=358
 # @@protoc_insertion_point(module_scope)
@@ -39,6 +39,16 @@ class PowerServiceStub(object):
                 request_serializer=power__pb2.PowerRequest.SerializeToString,
                 response_deserializer=power__pb2.PowerResponse.FromString,
                 _registered_method=True)
+        self.ComputePowerBatch = channel.unary_unary(
+                '/PowerService/ComputePowerBatch',
+                request_serializer=power__pb2.PowerBatchRequest.SerializeToString,
+                response_deserializer=power__pb2.PowerBatchResponse.FromString,
+                _registered_method=True)
+        self.ComputePowerStream = channel.stream_stream(
+                '/PowerService/ComputePowerStream',
+                request_serializer=power__pb2.PowerBatchRequest.SerializeToString,
+                response_deserializer=power__pb2.PowerBatchResponse.FromString,
+                _registered_method=True)
 
 
 class PowerServiceServicer(object):
@@ -50,6 +60,20 @@ class PowerServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def ComputePowerBatch(self, request, context):
+        """Many x ** y at once, evaluated by the server in one vectorized pass
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ComputePowerStream(self, request_iterator, context):
+        """A continuous feed: one response per request message, in the same order
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_PowerServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +82,16 @@ def add_PowerServiceServicer_to_server(servicer, server):
                     request_deserializer=power__pb2.PowerRequest.FromString,
                     response_serializer=power__pb2.PowerResponse.SerializeToString,
             ),
+            'ComputePowerBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.ComputePowerBatch,
+                    request_deserializer=power__pb2.PowerBatchRequest.FromString,
+                    response_serializer=power__pb2.PowerBatchResponse.SerializeToString,
+            ),
+            'ComputePowerStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.ComputePowerStream,
+                    request_deserializer=power__pb2.PowerBatchRequest.FromString,
+                    response_serializer=power__pb2.PowerBatchResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'PowerService', rpc_method_handlers)
@@ -95,3 +129,57 @@ class PowerService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def ComputePowerBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/PowerService/ComputePowerBatch',
+            power__pb2.PowerBatchRequest.SerializeToString,
+            power__pb2.PowerBatchResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ComputePowerStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/PowerService/ComputePowerStream',
+            power__pb2.PowerBatchRequest.SerializeToString,
+            power__pb2.PowerBatchResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)